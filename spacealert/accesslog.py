@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Space Alert Misson Player at
+# https://github.com/MartinAltmayer/spacealert.
+#
+# Copyright 2015 Martin Altmayer
+# The Space Alert board game was created by Vlaada Chvátil.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import sys, json, queue, random, threading, time, datetime
+
+MODES = ('off', 'sampled', 'full')
+
+
+class AccessLog:
+    """Buffered access log which writes one JSON object per request. Request handlers only put a tuple
+    into a queue; formatting and writing happen in a background thread, so that a slow terminal or pipe
+    does not slow down requests.
+
+    *mode* is one of MODES. In 'sampled' mode only a fraction *sampleRate* of the requests is logged (but
+    all server errors and all requests with an error message). *file* is a text file and defaults to sys.stderr. If the background thread cannot
+    keep up and more than *maxQueued* records are waiting, further records are dropped and counted in
+    *dropped*.
+    """
+    # Names of the fields of a record, in the order used by log
+    FIELDS = ('time', 'client', 'method', 'path', 'status', 'bytes', 'generation', 'latency', 'error')
+
+    def __init__(self, mode='full', file=None, sampleRate=0.1, maxQueued=10000):
+        if mode not in MODES:
+            raise ValueError("Unknown access log mode '{}', expected one of {}.".format(mode, ', '.join(MODES)))
+        self.mode = mode
+        self.file = file
+        self.sampleRate = sampleRate
+        self.dropped = 0
+        self._random = random.Random()
+        self._queue = queue.Queue(maxQueued)
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return self.mode != 'off'
+
+    def start(self):
+        """Start the background thread which writes the records."""
+        if self._thread is None and self.enabled:
+            self._thread = threading.Thread(target=self._run, name="AccessLog")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """Write all waiting records and stop the background thread."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def log(self, client, method, path, status, bytes, generation, latency, error=None):
+        """Log a request. *bytes* is the size of the response including headers, *generation* the time in
+        seconds spent on generating or rendering the mission (None for other requests) and *latency* the
+        time in seconds from reading the request to sending the last byte. *error* is an optional message
+        describing what went wrong while handling the request."""
+        if self.mode == 'off' or self.mode == 'sampled' and status < 500 and error is None \
+                and self._random.random() >= self.sampleRate:
+            return
+        try:
+            self._queue.put_nowait((time.time(), client, method, path, status, bytes, generation, latency,
+                                    error))
+        except queue.Full:
+            self.dropped += 1
+
+    def format(self, record):
+        """Return the log line (without newline) for a record as passed to log."""
+        record = dict(zip(self.FIELDS, record))
+        record['time'] = datetime.datetime.fromtimestamp(record['time'], datetime.timezone.utc) \
+                            .isoformat(timespec='milliseconds')
+        for key in ('generation', 'latency'):
+            if record[key] is not None:
+                record[key] = round(record[key] * 1000, 3) # milliseconds
+        if record['error'] is None:
+            del record['error']
+        return json.dumps(record, separators=(',', ':'))
+
+    def _run(self):
+        while True:
+            records = [self._queue.get()]
+            # Write everything that has accumulated in one go
+            while True:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in records
+            lines = [self.format(record) for record in records if record is not None]
+            file = self.file if self.file is not None else sys.stderr
+            try:
+                if len(lines) > 0:
+                    file.write('\n'.join(lines) + '\n')
+                    file.flush()
+            except (OSError, ValueError) as e: # ValueError: file closed
+                print("AccessLog: cannot write records: {}".format(e), file=sys.stderr)
+            if stop:
+                return
+
+
+class CountingWriter:
+    """Wrapper around a binary file which counts the number of bytes written to it."""
+    __slots__ = ('file', 'count')
+
+    def __init__(self, file):
+        self.file = file
+        self.count = 0
+
+    def write(self, data):
+        self.count += len(data)
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
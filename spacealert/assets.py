@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Space Alert Misson Player at
+# https://github.com/MartinAltmayer/spacealert.
+#
+# Copyright 2015 Martin Altmayer
+# The Space Alert board game was created by Vlaada Chvátil.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os, posixpath, mimetypes, gzip, hashlib, threading, time, urllib.parse
+
+
+class Asset:
+    """A static file held in memory. *gzipped* is the gzip-compressed content or None if the file is not
+    compressible. *etag* and *gzipEtag* are strong ETags of the two representations. *path* is None for
+    generated assets (see AssetCache.add)."""
+    __slots__ = ('path', 'content', 'gzipped', 'etag', 'gzipEtag', 'contentType', 'cacheControl',
+                 'mtime', 'checked')
+
+    def __init__(self, path, content, mtime, contentType, cacheControl, compress):
+        self.path = path
+        self.content = content
+        self.mtime = mtime
+        self.contentType = contentType
+        self.cacheControl = cacheControl
+        self.checked = time.monotonic()
+        digest = hashlib.sha1(content).hexdigest()
+        self.etag = '"{}"'.format(digest)
+        self.gzipped = None
+        self.gzipEtag = None
+        if compress:
+            gzipped = gzip.compress(content, 9, mtime=0)
+            if len(gzipped) < len(content):
+                self.gzipped = gzipped
+                self.gzipEtag = '"{}-gzip"'.format(digest)
+
+
+class AssetCache:
+    """In-memory cache of the static files of the player. *root* is the directory containing the files,
+    *directories* and *files* specify which files (given as URL paths) are served. All files are loaded
+    at startup. Compressible text files are kept in gzip-compressed form, too. The modification time of a
+    file is checked at most every *checkInterval* seconds; changed files are reloaded.
+    """
+    COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+    CONTENT_TYPES = {'.htm': 'text/html', '.js': 'application/javascript', '.ogg': 'audio/ogg',
+                     '.mp3': 'audio/mpeg', '.svg': 'image/svg+xml', '.json': 'application/json'}
+    # Pages and scripts change with the program, so clients must revalidate them (cheap thanks to ETags).
+    # Images and audio files are only revalidated after a day.
+    CACHE_CONTROL_PAGES = 'no-cache'
+    CACHE_CONTROL_MEDIA = 'public, max-age=86400'
+
+    def __init__(self, root, directories=('/audio/', '/images/'), files=('/index.htm', '/player.js'),
+                 checkInterval=2.):
+        self.root = root
+        self.directories = tuple(directories)
+        self.files = tuple(files)
+        self.checkInterval = checkInterval
+        self.assets = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Load all files into memory."""
+        for urlPath in self.files:
+            self.get(urlPath)
+        for directory in self.directories:
+            fsDirectory = self._fsPath(directory)
+            if os.path.isdir(fsDirectory):
+                for fileName in sorted(os.listdir(fsDirectory)):
+                    self.get(directory + fileName)
+
+    def totalSize(self):
+        """Return the number of bytes held in memory."""
+        return sum(len(asset.content) + len(asset.gzipped or b'') for asset in list(self.assets.values()))
+
+    def add(self, urlPath, content, contentType=None):
+        """Add a generated file (e.g. an audio sprite) which is served like the files on disk, but never
+        reloaded. It replaces a file of the same path."""
+        if contentType is None:
+            contentType = self._contentType(urlPath)
+        asset = Asset(None, content, None, contentType, self._cacheControl(urlPath),
+                      contentType.startswith(self.COMPRESSIBLE_TYPES))
+        with self._lock:
+            self.assets[urlPath] = asset
+        return asset
+
+    def isAllowed(self, urlPath):
+        """Return whether *urlPath* (which must be normalized) may be served from this cache."""
+        return urlPath in self.files or urlPath.startswith(self.directories)
+
+    def get(self, urlPath):
+        """Return the Asset for the given URL path or None if there is no such file."""
+        urlPath = posixpath.normpath(urllib.parse.unquote(urlPath))
+        if not self.isAllowed(urlPath):
+            return None
+        asset = self.assets.get(urlPath)
+        now = time.monotonic()
+        if asset is not None and (asset.path is None or now - asset.checked < self.checkInterval):
+            return asset
+        with self._lock:
+            try:
+                mtime = os.stat(asset.path if asset is not None else self._fsPath(urlPath)).st_mtime
+            except OSError:
+                self.assets.pop(urlPath, None)
+                return None
+            if asset is None or asset.mtime != mtime:
+                asset = self._load(urlPath)
+                if asset is None:
+                    self.assets.pop(urlPath, None)
+                    return None
+                self.assets[urlPath] = asset
+            else: asset.checked = now
+            return asset
+
+    def _fsPath(self, urlPath):
+        return os.path.join(self.root, *urlPath.strip('/').split('/'))
+
+    def _load(self, urlPath):
+        path = self._fsPath(urlPath)
+        if not os.path.isfile(path):
+            return None
+        mtime = os.stat(path).st_mtime
+        with open(path, 'rb') as file:
+            content = file.read()
+        contentType = self._contentType(path)
+        compress = contentType.startswith(self.COMPRESSIBLE_TYPES)
+        return Asset(path, content, mtime, contentType, self._cacheControl(urlPath), compress)
+
+    def _contentType(self, path):
+        extension = os.path.splitext(path)[1].lower()
+        return self.CONTENT_TYPES.get(extension) or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    def _cacheControl(self, urlPath):
+        if urlPath.startswith(self.directories):
+            return self.CACHE_CONTROL_MEDIA
+        else: return self.CACHE_CONTROL_PAGES
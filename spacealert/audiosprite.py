@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Space Alert Misson Player at
+# https://github.com/MartinAltmayer/spacealert.
+#
+# Copyright 2015 Martin Altmayer
+# The Space Alert board game was created by Vlaada Chvátil.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Audio sprites: All clips of the player are packed into a single file per codec, so that the player
+# needs one request instead of one per clip. The player seeks to the offset of a track within the sprite
+# and stops playback after its duration. Both formats are packed without re-encoding:
+#
+#   - MP3: The frames of all clips are concatenated (without ID3 tags and the Xing/Info frame). Clips are
+#     separated by GAP seconds of silent frames, so that a timer firing late does not play the next clip.
+#   - Ogg Vorbis: The clips are concatenated to a chained Ogg file. Each clip gets its own serial number.
+#
+import os, struct, json, hashlib
+
+# All tracks used by player.js
+TRACKS = ("begin", "repeat", "noise", "alarm5",
+          "alert", "incoming_data", "data_transfer", "comm_down", "comm_restored",
+          "time1", "time2", "time3", "time4", "time5", "time6", "time7", "time8",
+          "zone_red", "zone_white", "zone_blue",
+          "threat", "serious_threat", "internal_threat", "serious_internal",
+          "phase1_60", "phase1_20", "phase1_7",
+          "phase2_60", "phase2_20", "phase2_7",
+          "phase3_60", "phase3_20", "phase3_7")
+
+GAP = 0.5 # seconds of silence between two clips in MP3 sprites
+
+CONTENT_TYPES = {'mp3': 'audio/mpeg', 'ogg': 'audio/ogg'}
+# Order in the manifest, i.e. order of preference in the player. Browsers support seeking within MP3
+# files much better than within chained Ogg files.
+CODECS = ('mp3', 'ogg')
+
+
+class AudioSpriteError(ValueError):
+    """Raised when a clip cannot be packed into a sprite."""
+    def __init__(self, name, message):
+        super().__init__("Audio clip '{}': {}".format(name, message))
+        self.name = name
+
+
+class AudioSprite:
+    """A sprite for one codec. *content* is the file content, *offsets* maps track names to pairs
+    (start, duration) in seconds."""
+    def __init__(self, codec, content, offsets):
+        self.codec = codec
+        self.content = content
+        self.offsets = offsets
+        self.version = hashlib.sha1(content).hexdigest()[:12]
+
+    @property
+    def contentType(self):
+        return CONTENT_TYPES[self.codec]
+
+    @property
+    def fileName(self):
+        return 'sprite.' + self.codec
+
+    def manifestEntry(self, directory='audio/'):
+        """Return the manifest entry of this sprite. The URL contains a version parameter, so that clients
+        never combine a cached sprite with the offsets of another version."""
+        return {'url': '{}{}?v={}'.format(directory, self.fileName, self.version),
+                'type': self.contentType,
+                'tracks': {name: [round(start, 3), round(duration, 3)]
+                           for name, (start, duration) in self.offsets.items()}}
+
+
+def build(directory, tracks=TRACKS, codecs=CODECS):
+    """Build sprites from the clips <track>.<codec> in *directory*. Return a list of AudioSprites in the
+    order of *codecs*."""
+    builders = {'mp3': buildMp3, 'ogg': buildOgg}
+    sprites = []
+    for codec in codecs:
+        clips = []
+        for name in tracks:
+            with open(os.path.join(directory, name + '.' + codec), 'rb') as file:
+                clips.append((name, file.read()))
+        content, offsets = builders[codec](clips)
+        sprites.append(AudioSprite(codec, content, offsets))
+    return sprites
+
+
+def manifest(sprites, directory='audio/'):
+    """Return the manifest of the given sprites: a list of dicts with keys 'url', 'type' and 'tracks' (see
+    AudioSprite.manifestEntry)."""
+    return [sprite.manifestEntry(directory) for sprite in sprites]
+
+
+#=====#
+# MP3 #
+#=====#
+
+MP3_BITRATES = {  # kbit/s by bitrate index for layer III
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),    # MPEG 1
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),        # MPEG 2 and 2.5
+}
+MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+class Mp3Header:
+    """Header of an MPEG audio layer III frame."""
+    def __init__(self, data, pos):
+        header = int.from_bytes(data[pos:pos+4], 'big')
+        if header >> 21 != 0x7ff:
+            raise ValueError("No frame sync at byte {}".format(pos))
+        self.version = (header >> 19) & 3
+        layer = (header >> 17) & 3
+        bitrateIndex = (header >> 12) & 15
+        sampleRateIndex = (header >> 10) & 3
+        if self.version == 1 or layer != 1 or bitrateIndex in (0, 15) or sampleRateIndex == 3:
+            raise ValueError("Unsupported frame header at byte {}".format(pos))
+        self.header = header
+        self.mpeg1 = self.version == 3
+        self.sampleRate = MP3_SAMPLE_RATES[self.version][sampleRateIndex]
+        self.bitrate = MP3_BITRATES[1 if self.mpeg1 else 2][bitrateIndex]
+        self.padding = (header >> 9) & 1
+        self.mono = (header >> 6) & 3 == 3
+        self.samples = 1152 if self.mpeg1 else 576
+        self.length = (144 if self.mpeg1 else 72) * self.bitrate * 1000 // self.sampleRate + self.padding
+
+    @property
+    def sideInfoLength(self):
+        if self.mpeg1:
+            return 17 if self.mono else 32
+        else: return 9 if self.mono else 17
+
+    def isInfoFrame(self, data, pos):
+        """Return whether the frame at *pos* is a Xing/Info frame (which contains no audio)."""
+        tagPos = pos + 4 + self.sideInfoLength + (0 if self.header & 0x10000 else 2)
+        return data[tagPos:tagPos+4] in (b'Xing', b'Info')
+
+    def silentFrame(self):
+        """Return a frame with the format of this header containing silence. A frame whose side information
+        and main data are zero decodes to silence."""
+        header = self.header & ~0x200 | 0x10000 # no padding, no CRC
+        length = (144 if self.mpeg1 else 72) * self.bitrate * 1000 // self.sampleRate
+        return header.to_bytes(4, 'big') + bytes(length - 4)
+
+
+def readMp3(name, data):
+    """Return the audio frames of an MP3 file as a tuple (bytes, first header, number of frames)."""
+    pos = 0
+    if data[:3] == b'ID3':
+        size = data[6] << 21 | data[7] << 14 | data[8] << 7 | data[9]
+        pos = 10 + size + (10 if data[5] & 0x10 else 0)
+    end = len(data)
+    if data[-128:-125] == b'TAG':
+        end -= 128
+    start = pos
+    first = None
+    frames = 0
+    try:
+        while pos < end:
+            header = Mp3Header(data, pos)
+            if first is None:
+                first = header
+                if header.isInfoFrame(data, pos):
+                    pos += header.length
+                    start = pos
+                    continue
+            elif header.sampleRate != first.sampleRate or header.mono != first.mono:
+                raise ValueError("Sample rate or channels change at byte {}".format(pos))
+            frames += 1
+            pos += header.length
+    except ValueError as e:
+        raise AudioSpriteError(name, e) from None
+    if frames == 0:
+        raise AudioSpriteError(name, "No audio frames")
+    return data[start:min(pos, end)], first, frames
+
+
+def buildMp3(clips):
+    """Pack MP3 clips (a list of pairs (name, file content)). Return the sprite content and the offsets."""
+    parts = []
+    offsets = {}
+    samples = 0
+    format = None
+    for name, data in clips:
+        frames, header, count = readMp3(name, data)
+        if format is None:
+            format = header
+            silence = header.silentFrame()
+            gap = [silence] * max(1, round(GAP * header.sampleRate / header.samples))
+        elif (header.sampleRate, header.mono, header.version) \
+                != (format.sampleRate, format.mono, format.version):
+            raise AudioSpriteError(name, "All clips must have the same sample rate and channels")
+        else:
+            parts.extend(gap)
+            samples += len(gap) * format.samples
+        offsets[name] = (samples / format.sampleRate, count * format.samples / format.sampleRate)
+        parts.append(frames)
+        samples += count * format.samples
+    return b''.join(parts), offsets
+
+
+#=====#
+# Ogg #
+#=====#
+
+def _oggCrcTable():
+    table = []
+    for i in range(256):
+        r = i << 24
+        for j in range(8):
+            r = (r << 1) ^ 0x04c11db7 if r & 0x80000000 else r << 1
+        table.append(r & 0xffffffff)
+    return table
+
+OGG_CRC_TABLE = _oggCrcTable()
+OGG_HEADER = struct.Struct('<4sBBqIIIB') # capture pattern, version, type, granule, serial, sequence, CRC, segments
+
+
+def oggCrc(data):
+    crc = 0
+    table = OGG_CRC_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xffffffff) ^ table[(crc >> 24) ^ byte]
+    return crc
+
+
+def readOgg(name, data, serial):
+    """Return the pages of an Ogg Vorbis file with their serial number replaced by *serial*, as a tuple
+    (bytes, sample rate, number of samples)."""
+    pages = []
+    pos = 0
+    sampleRate = None
+    granule = 0
+    while pos < len(data):
+        try:
+            capture, version, type, pageGranule, oldSerial, sequence, crc, segmentCount \
+                = OGG_HEADER.unpack_from(data, pos)
+        except struct.error:
+            raise AudioSpriteError(name, "Truncated page at byte {}".format(pos)) from None
+        if capture != b'OggS':
+            raise AudioSpriteError(name, "No Ogg page at byte {}".format(pos))
+        bodyPos = pos + OGG_HEADER.size + segmentCount
+        end = bodyPos + sum(data[pos+OGG_HEADER.size:bodyPos])
+        if sampleRate is None:
+            # the first page contains the Vorbis identification header
+            if data[bodyPos:bodyPos+7] != b'\x01vorbis':
+                raise AudioSpriteError(name, "Not a Vorbis stream")
+            sampleRate = struct.unpack_from('<I', data, bodyPos + 12)[0]
+        if pageGranule != -1:
+            granule = pageGranule
+        page = bytearray(data[pos:end])
+        struct.pack_into('<II', page, 14, serial, 0)
+        struct.pack_into('<I', page, 22, oggCrc(page))
+        pages.append(bytes(page))
+        pos = end
+    if sampleRate is None:
+        raise AudioSpriteError(name, "Empty file")
+    return b''.join(pages), sampleRate, granule
+
+
+def buildOgg(clips):
+    """Pack Ogg Vorbis clips (a list of pairs (name, file content)). Return the sprite content and the
+    offsets."""
+    parts = []
+    offsets = {}
+    time = 0.
+    for serial, (name, data) in enumerate(clips, start=1):
+        pages, sampleRate, samples = readOgg(name, data, serial)
+        duration = samples / sampleRate
+        offsets[name] = (time, duration)
+        parts.append(pages)
+        time += duration
+    return b''.join(parts), offsets
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Build audio sprites and their manifest (sprite.json). "
+                                     "The server builds them at startup, so this is only necessary to "
+                                     "serve the player with a different web server.")
+    parser.add_argument('--audio', default='audio', help="Directory containing the clips, defaults to 'audio'.")
+    parser.add_argument('--output', default=None, help="Output directory, defaults to the clip directory.")
+    args = parser.parse_args()
+    output = args.output if args.output is not None else args.audio
+    sprites = build(args.audio)
+    for sprite in sprites:
+        with open(os.path.join(output, sprite.fileName), 'wb') as file:
+            file.write(sprite.content)
+        print("{}: {} tracks, {:.1f} MB".format(sprite.fileName, len(sprite.offsets), len(sprite.content) / 2**20))
+    with open(os.path.join(output, 'sprite.json'), 'w') as file:
+        json.dump(manifest(sprites), file)
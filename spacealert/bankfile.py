@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Space Alert Misson Player at
+# https://github.com/MartinAltmayer/spacealert.
+#
+# Copyright 2015 Martin Altmayer
+# The Space Alert board game was created by Vlaada Chvátil.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Mission bank files: Many pre-generated missions in a compact binary format, so that the server can
+# sample from millions of missions without generating them after each restart. The file is memory-mapped
+# and a mission is only decoded when it is requested. All numbers are little-endian.
+#
+#   - File header (HEADER): magic, version, record size, number of keys, number of records and the offset
+#     of the key table.
+#   - Records (one per mission, all of the same size): the record header (RECORD_HEADER) with the seed,
+#     the difficulty score (Mission.difficulty), players, double actions and difficulty, followed by the
+#     data of a PackedMission (without the padding at the end).
+#   - Score indexes (one per key): the numbers of the key's records (unsigned 32-bit integers) sorted by
+#     score, so that missions within a range of scores can be found by bisection.
+#   - Key table (KEY_ENTRY, one entry per key): players, double actions, difficulty, index of the first
+#     record, number of records and the offset of the score index.
+#
+# A key is a tuple (players, double, difficulty) as in spacealert.MISSION_KEYS; the missions of a key were
+# generated with makeSeededMission(spacealert.makeOptions(*key), seed). The records of each key are
+# contiguous and in the order in which they were generated, so that they can be written while missions
+# are generated; only the scores of one key are kept in memory to sort the index.
+#
+# Build a file with 1000 missions for each key:
+#
+#   python3 bankfile.py build -n 1000 -o missions.bank
+#
+import sys, struct, mmap, array, bisect, random, shutil, tempfile
+
+import spacealert
+from spacealert import PackedMission
+
+MAGIC = b'SABANK\r\n'
+VERSION = 2
+HEADER = struct.Struct('<8sHHIIQ')   # magic, version, record size, key count, record count, key table offset
+RECORD_HEADER = struct.Struct('<QfBBBx') # seed, score, players, double, difficulty mask
+KEY_ENTRY = struct.Struct('<BBBxIIQ') # players, double, difficulty mask, first record, record count,
+                                      # index offset
+INDEX_ENTRY = struct.Struct('<I')     # record number
+MAX_PHASES = 3
+MAX_EVENTS = 48  # generated missions have about 30 events
+# PackedMission: counts, phase ends, 2 shorts and 5 bytes per event; rounded up to 8 bytes
+RECORD_SIZE = (RECORD_HEADER.size + 4 + 2 * MAX_PHASES + MAX_EVENTS * 9 + 7) // 8 * 8
+DIFFICULTY_CODES = 'wyr'
+
+
+class BankFileError(ValueError):
+    """Raised when a file is not a valid mission bank or a mission does not fit into a record."""
+
+
+def difficultyMask(difficulty):
+    """Return the bit mask of a difficulty like 'wy' (w=1, y=2, r=4)."""
+    return sum(1 << DIFFICULTY_CODES.index(c) for c in set(difficulty))
+
+
+def difficultyFromMask(mask):
+    return ''.join(c for i, c in enumerate(DIFFICULTY_CODES) if mask & (1 << i))
+
+
+def _littleEndianIndex(numbers):
+    """Return the bytes of a score index (an array.array('I') of record numbers)."""
+    if sys.byteorder != 'little':
+        numbers = array.array('I', numbers)
+        numbers.byteswap()
+    return numbers.tobytes()
+
+
+def _littleEndian(data, phaseCount, eventCount):
+    """Convert the shorts of PackedMission *data* between native and little-endian byte order
+    (the conversion is its own inverse)."""
+    if sys.byteorder == 'little':
+        return bytes(data)
+    shorts = 2 + phaseCount + 2 * eventCount # counts, phase ends, starts and durations
+    values = array.array('H', bytes(data[:2*shorts]))
+    values.byteswap()
+    return values.tobytes() + bytes(data[2*shorts:])
+
+
+class BankWriter:
+    """Write a mission bank file to *path*. Missions are added one key at a time with writeKey. Call close
+    (or use the writer as a context manager) to write the score indexes, the key table and the header.
+    Records are written immediately; score indexes are kept in a temporary file until close."""
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.keys = [] # (key, first record, record count, offset in the index file)
+        self.count = 0
+        self._indexFile = tempfile.TemporaryFile()
+        self.file.write(bytes(HEADER.size)) # written in close
+
+    def writeKey(self, key, missions):
+        """Write the missions for *key* (an iterable of pairs (seed, mission)). Each key may only be
+        written once."""
+        if any(k == key for k, first, count, offset in self.keys):
+            raise ValueError("Key {} has already been written.".format(key))
+        players, double, difficulty = key
+        mask = difficultyMask(difficulty)
+        scores = array.array('f') # as stored in the records, so that the index matches them exactly
+        for seed, mission in missions:
+            packed = PackedMission.fromMission(mission)
+            phaseCount, eventCount = packed._header()
+            if phaseCount > MAX_PHASES or eventCount > MAX_EVENTS:
+                raise BankFileError("Mission with seed {} has too many phases or events ({}, {})"
+                                    .format(seed, phaseCount, eventCount))
+            scores.append(mission.difficulty())
+            record = RECORD_HEADER.pack(seed, scores[-1], players, int(double), mask) \
+                        + _littleEndian(packed.data, phaseCount, eventCount)
+            self.file.write(record + bytes(RECORD_SIZE - len(record)))
+        first = self.count
+        index = array.array('I', sorted(range(first, first + len(scores)), key=lambda i: scores[i-first]))
+        self.keys.append((key, first, len(scores), self._indexFile.tell()))
+        self._indexFile.write(_littleEndianIndex(index))
+        self.count += len(scores)
+
+    def close(self):
+        if self.file.closed:
+            return
+        indexStart = self.file.tell()
+        self._indexFile.seek(0)
+        shutil.copyfileobj(self._indexFile, self.file)
+        self._indexFile.close()
+        offset = self.file.tell()
+        for (players, double, difficulty), first, count, indexOffset in self.keys:
+            self.file.write(KEY_ENTRY.pack(players, int(double), difficultyMask(difficulty), first, count,
+                                           indexStart + indexOffset))
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, RECORD_SIZE, len(self.keys), self.count, offset))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class BankReader:
+    """Read a mission bank file. The file is memory-mapped, so opening it is fast and memory is only used
+    for the records which are actually read (and shared between processes)."""
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, self.recordSize, keyCount, self.count, offset = HEADER.unpack_from(self._mmap)
+        except struct.error:
+            raise BankFileError("{} is not a mission bank file".format(path)) from None
+        if magic != MAGIC or version != VERSION:
+            raise BankFileError("{} is not a mission bank file of version {}".format(path, VERSION))
+        if self.recordSize != RECORD_SIZE:
+            raise BankFileError("{} has records of {} bytes instead of {}".format(path, self.recordSize, RECORD_SIZE))
+        # Records, indexes and key table must fit exactly into the file
+        recordsEnd = HEADER.size + self.count * self.recordSize
+        if not recordsEnd <= offset or offset + keyCount * KEY_ENTRY.size != len(self._mmap):
+            raise BankFileError("{} is truncated or corrupt: {} bytes instead of {} records and {} keys"
+                                .format(path, len(self._mmap), self.count, keyCount))
+        self.keys = {} # key -> (first record, record count, index offset)
+        for i in range(keyCount):
+            players, double, mask, first, count, indexOffset = \
+                KEY_ENTRY.unpack_from(self._mmap, offset + i * KEY_ENTRY.size)
+            if first + count > self.count or indexOffset < recordsEnd \
+                    or indexOffset + count * INDEX_ENTRY.size > offset:
+                raise BankFileError("{} is corrupt: invalid key table entry {}".format(path, i))
+            self.keys[(players, bool(double), difficultyFromMask(mask))] = (first, count, indexOffset)
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self._mmap.close()
+
+    def record(self, index):
+        """Return the record *index* as tuple (key, seed, score, PackedMission)."""
+        if not 0 <= index < self.count:
+            raise IndexError("Record index out of range: {}".format(index))
+        offset = HEADER.size + index * self.recordSize
+        seed, score, players, double, mask = RECORD_HEADER.unpack_from(self._mmap, offset)
+        offset += RECORD_HEADER.size
+        phaseCount, eventCount = struct.unpack_from('<HH', self._mmap, offset)
+        if phaseCount > MAX_PHASES or eventCount > MAX_EVENTS:
+            raise BankFileError("Record {} is corrupt: {} phases and {} events".format(index, phaseCount, eventCount))
+        size = 4 + 2 * phaseCount + 9 * eventCount
+        data = _littleEndian(self._mmap[offset:offset+size], phaseCount, eventCount)
+        return (players, bool(double), difficultyFromMask(mask)), seed, score, PackedMission(data)
+
+    def mission(self, index):
+        """Return the seed and the Mission of record *index* as a pair."""
+        key, seed, score, packed = self.record(index)
+        return seed, packed.toMission()
+
+    def score(self, index):
+        """Return the difficulty score of record *index* without decoding the mission."""
+        return RECORD_HEADER.unpack_from(self._mmap, HEADER.size + index * self.recordSize)[1]
+
+    def sortedRecord(self, key, position):
+        """Return the index of the record of *key* at *position* in the order of scores."""
+        first, count, indexOffset = self.keys[key]
+        return INDEX_ENTRY.unpack_from(self._mmap, indexOffset + position * INDEX_ENTRY.size)[0]
+
+    def range(self, key, low=None, high=None):
+        """Return the positions (i, j) in the order of scores such that the records at positions i, ...,
+        j-1 (see sortedRecord) are the missions of *key* with a score in [low, high] (None means
+        unbounded). Raise KeyError if the file contains no missions for *key*."""
+        first, count, indexOffset = self.keys[key]
+        scores = _Scores(self, key)
+        i = bisect.bisect_left(scores, low, 0, count) if low is not None else 0
+        j = bisect.bisect_right(scores, high, 0, count) if high is not None else count
+        return i, max(i, j)
+
+    def scoreRange(self, key, lowQuantile, highQuantile):
+        """Return the scores (low, high) at the given quantiles (numbers between 0 and 1) of the missions of
+        *key* (compare MissionBank.scoreRange). Return (None, None) if there are no missions for *key*."""
+        first, count, indexOffset = self.keys.get(key, (0, 0, 0))
+        if count == 0:
+            return None, None
+        def quantile(q):
+            return self.score(self.sortedRecord(key, min(int(q * count), count-1)))
+        return quantile(lowQuantile), quantile(highQuantile)
+
+    def sample(self, key, low=None, high=None, rng=random):
+        """Return the index of a random record of *key* with a score in [low, high], or None if there is no
+        such record."""
+        i, j = self.range(key, low, high)
+        return self.sortedRecord(key, rng.randrange(i, j)) if i < j else None
+
+
+class _Scores:
+    """Sequence view of the scores of the records of one key in the order of the score index, for
+    bisect."""
+    def __init__(self, reader, key):
+        self.reader = reader
+        self.key = key
+
+    def __getitem__(self, position):
+        return self.reader.score(self.reader.sortedRecord(self.key, position))
+
+
+def build(path, keys, number, seed=None, workers=None, progress=None):
+    """Generate *number* missions for each key in *keys* (tuples (players, double, difficulty)) and write
+    them to a bank file at *path*. Missions are generated in *workers* processes (see
+    MissionGenerator.iterMissions). The seeds are derived from *seed*, so the same *seed* produces the same
+    file. *progress* is called with each key before its missions are generated."""
+    keySeeds = spacealert.missionSeeds(seed, len(keys))
+    with BankWriter(path) as writer:
+        for key, keySeed in zip(keys, keySeeds):
+            if progress is not None:
+                progress(key)
+            generator = spacealert.MissionGenerator(spacealert.makeOptions(*key))
+            seeds = spacealert.missionSeeds(keySeed, number)
+            writer.writeKey(key, zip(seeds, generator.iterMissions(number, workers, keySeed)))
+
+
+if __name__ == "__main__":
+    import argparse, os, time
+    parser = argparse.ArgumentParser(description="Build or inspect mission bank files (see server.py --bank-file).")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    buildParser = subparsers.add_parser('build', help="Generate missions and write them to a bank file.")
+    buildParser.add_argument('-o', '--output', required=True, help="Path of the bank file.")
+    buildParser.add_argument('-n', '--number', type=int, default=1000, help="Missions per combination of players, double actions and difficulty, defaults to 1000.")
+    buildParser.add_argument('-p', '--players', type=int, choices=[4, 5], help="Only generate missions for this number of players.")
+    buildParser.add_argument('-d', '--difficulty', choices=spacealert.DIFFICULTIES, action='append', help="Only generate missions with this difficulty (may be given several times).")
+    buildParser.add_argument('--seed', type=int, default=None, help="Seed from which the seeds of all missions are derived.")
+    buildParser.add_argument('-w', '--workers', type=int, default=None, help="Number of worker processes, defaults to the number of CPUs.")
+    infoParser = subparsers.add_parser('info', help="Print the keys and score ranges of a bank file.")
+    infoParser.add_argument('path')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        keys = [(players, double, difficulty) for players, double, difficulty in spacealert.MISSION_KEYS
+                if (args.players is None or players == args.players)
+                and (args.difficulty is None or difficulty in args.difficulty)]
+        start = time.perf_counter()
+        build(args.output, keys, args.number, args.seed, args.workers,
+              progress=lambda key: print("Generating {} missions for {}".format(args.number, key), file=sys.stderr))
+        print("Wrote {} missions ({:.1f} MB) in {:.1f}s.".format(len(keys) * args.number,
+                                                                 os.path.getsize(args.output) / 2**20,
+                                                                 time.perf_counter() - start))
+    else:
+        reader = BankReader(args.path)
+        print("{} missions, {} bytes per record".format(len(reader), reader.recordSize))
+        for key, (first, count, indexOffset) in sorted(reader.keys.items()):
+            if count > 0:
+                print("{}: {} missions, scores {}-{}".format(key, count,
+                                                             reader.score(reader.sortedRecord(key, 0)),
+                                                             reader.score(reader.sortedRecord(key, count-1))))
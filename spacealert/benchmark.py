@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Space Alert Misson Player at
+# https://github.com/MartinAltmayer/spacealert.
+#
+# Copyright 2015 Martin Altmayer
+# The Space Alert board game was created by Vlaada Chvátil.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Micro-benchmarks for mission generation. For each configuration (players, double actions, difficulty)
+# makeMission and each stage of MissionGenerator are timed on their own: The inputs of a stage (e.g. the
+# alerts for chooseThreatTimes) are prepared from a fixed seed before the clock starts, so that runs on
+# the same machine are comparable. Results are written as JSON and can be compared against a baseline:
+#
+#   python3 benchmark.py -o baseline.json
+#   ... change something ...
+#   python3 benchmark.py --baseline baseline.json
+#
+# The second command exits with status 1 if any stage got slower by more than the tolerance. To make
+# results from a busy or throttled machine comparable, a fixed pure-Python workload is timed as well and
+# the comparison is relative to that calibration.
+#
+import sys, time, random, json, platform
+
+import spacealert
+from spacealert import Mission, InvalidMissionError, DIFFICULTIES, MISSION_KEYS, makeOptions
+
+
+def configurationName(key):
+    players, double, difficulty = key
+    return '{}-{}-{}'.format(players, 'double' if double else 'normal', difficulty)
+
+
+def prepareMission(generator, rng, threats=False):
+    """Return a new mission with phases and, if *threats* is true, alerts. Failed attempts are
+    repeated."""
+    while True:
+        mission = Mission()
+        generator.makePhases(mission, rng)
+        if not threats:
+            return mission
+        try:
+            generator.makeThreats(mission, rng)
+            return mission
+        except InvalidMissionError:
+            pass
+
+
+def prepareAlerts(generator, rng):
+    """Return alerts assigned to turns and phases (like makeThreats before it chooses times) and the
+    phases."""
+    mission = prepareMission(generator, rng)
+    alerts = generator.assignThreatsToTurns(generator.chooseThreatTuple(rng), rng)
+    for alert in alerts:
+        alert.phase = mission.phases[0] if alert.turn <= 4 else mission.phases[1]
+    return alerts, mission.phases
+
+
+# Benchmarked stages: name -> (prepare, run). prepare is called with the generator and a random number
+# generator and returns the arguments for run (which gets the generator and the random number generator
+# as first arguments). Only run is timed.
+STAGES = {
+    'makeMission':          (lambda g, rng: (), lambda g, rng: g.makeMission(rng)),
+    'choosePhaseLengths':   (lambda g, rng: (), lambda g, rng: g.choosePhaseLengths(rng)),
+    'chooseThreatTuple':    (lambda g, rng: (), lambda g, rng: g.chooseThreatTuple(rng)),
+    'assignThreatsToTurns': (lambda g, rng: (g.chooseThreatTuple(rng),),
+                             lambda g, rng, tt: g.assignThreatsToTurns(tt, rng)),
+    'chooseThreatTimes':    (prepareAlerts,
+                             lambda g, rng, alerts, phases: g.chooseThreatTimes(alerts, phases, rng)),
+    'chooseThreatZones':    (lambda g, rng: prepareAlerts(g, rng)[:1],
+                             lambda g, rng, alerts: g.chooseThreatZones(alerts, rng)),
+    'chooseDifficulties':   (lambda g, rng: prepareAlerts(g, rng)[:1],
+                             lambda g, rng, alerts: g.chooseDifficulties(alerts)),
+    'makeOtherEvents':      (lambda g, rng: (prepareMission(g, rng, threats=True),),
+                             lambda g, rng, mission: g.makeOtherEvents(mission, rng)),
+}
+
+
+def timeStage(options, stage, number, repeat, seed):
+    """Time *number* calls of *stage* (a key of STAGES) in *repeat* rounds. Return a dict with the mean
+    time per call in the fastest round ('seconds') and the fraction of calls in all rounds which raised an
+    InvalidMissionError ('failureRate'). Failures are part of the cost of a stage and are not repeated."""
+    prepare, run = STAGES[stage]
+    generator = spacealert.MissionGenerator(options)
+    rng = random.Random(seed)
+    prepare(generator, rng) # warm up, e.g. compute the distribution tables
+    best = None
+    failures = 0
+    for i in range(repeat):
+        inputs = [prepare(generator, rng) for j in range(number)]
+        start = time.perf_counter()
+        for args in inputs:
+            try:
+                run(generator, rng, *args)
+            except InvalidMissionError:
+                failures += 1
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best:
+            best = seconds
+    return {'seconds': best / number, 'failureRate': failures / (repeat * number)}
+
+
+def calibrate(repeat=5):
+    """Return the time of a fixed pure-Python workload (fastest of *repeat* rounds) in seconds."""
+    rng = random.Random(0)
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        values = sorted(rng.random() for j in range(20000))
+        sum(int(v * 100) % 7 for v in values)
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best:
+            best = seconds
+    return best
+
+
+def runBenchmarks(keys=None, stages=None, number=200, repeat=5, seed=0, progress=None):
+    """Run the benchmarks for the given configurations (default: all) and stages (default: all). Return
+    the results as dict which can be serialized to JSON. *progress* is called with each configuration
+    name before it is benchmarked."""
+    keys = keys if keys is not None else MISSION_KEYS
+    stages = stages if stages is not None else list(STAGES)
+    results = {}
+    calibration = calibrate()
+    for key in keys:
+        name = configurationName(key)
+        if progress is not None:
+            progress(name)
+        options = makeOptions(*key)
+        results[name] = {stage: timeStage(options, stage, number, repeat, seed) for stage in stages}
+        calibration = min(calibration, calibrate())
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'number': number,
+        'repeat': repeat,
+        'seed': seed,
+        'calibration': calibration,
+        'results': results,
+    }
+
+
+def compare(current, baseline, tolerance=0.25):
+    """Compare two results of runBenchmarks. Return a list of tuples (configuration, stage, baseline
+    seconds, current seconds) for all stages which are slower than the baseline by more than the
+    fraction *tolerance*. Baseline times are scaled by the ratio of the calibration times, i.e. the
+    returned baseline seconds are what the baseline would take on the current machine. Stages which are
+    missing in one of the results are ignored."""
+    if 'calibration' in current and 'calibration' in baseline:
+        scale = current['calibration'] / baseline['calibration']
+    else: scale = 1.
+    regressions = []
+    for name, stages in sorted(current['results'].items()):
+        for stage, result in sorted(stages.items()):
+            try:
+                old = baseline['results'][name][stage]['seconds'] * scale
+            except KeyError:
+                continue
+            if result['seconds'] > old * (1 + tolerance):
+                regressions.append((name, stage, old, result['seconds']))
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark mission generation and each of its stages.")
+    parser.add_argument('-o', '--output', help="Write the results as JSON to this file instead of stdout.")
+    parser.add_argument('--baseline', help="Compare with the results stored in this file and exit with status 1 if a stage got slower.")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed slowdown compared to the baseline, defaults to 0.25 (25%%).")
+    parser.add_argument('-n', '--number', type=int, default=200, help="Calls per round, defaults to 200.")
+    parser.add_argument('-r', '--repeat', type=int, default=5, help="Rounds; the fastest one is reported. Defaults to 5.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the inputs, defaults to 0.")
+    parser.add_argument('-s', '--stage', action='append', choices=list(STAGES), help="Only benchmark this stage (may be given several times).")
+    parser.add_argument('-p', '--players', type=int, choices=[4, 5], help="Only benchmark configurations for this number of players.")
+    parser.add_argument('-d', '--difficulty', choices=DIFFICULTIES, help="Only benchmark configurations with this difficulty.")
+    args = parser.parse_args()
+
+    keys = [key for key in MISSION_KEYS if (args.players is None or key[0] == args.players)
+                                            and (args.difficulty is None or key[2] == args.difficulty)]
+    result = runBenchmarks(keys, args.stage, args.number, args.repeat, args.seed,
+                           progress=lambda name: print(name, file=sys.stderr))
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+    else: print(text)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+        regressions = compare(result, baseline, args.tolerance)
+        for name, stage, old, new in regressions:
+            print("REGRESSION {} {}: {:.1f}µs -> {:.1f}µs (+{:.0f}%)"
+                  .format(name, stage, old * 1e6, new * 1e6, 100 * (new / old - 1)), file=sys.stderr)
+        if regressions:
+            print("{} stages are slower than the baseline by more than {:.0f}%."
+                  .format(len(regressions), 100 * args.tolerance), file=sys.stderr)
+            sys.exit(1)
+        print("No regressions compared to {}.".format(args.baseline), file=sys.stderr)
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Space Alert Misson Player at
+# https://github.com/MartinAltmayer/spacealert.
+#
+# Copyright 2015 Martin Altmayer
+# The Space Alert board game was created by Vlaada Chvátil.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Feasibility analysis of Options: Invalid or too restrictive options (e.g. set with -o key=value) would
+# otherwise only be noticed when a mission is generated, as ValueError from ThreatTuple or as
+# InvalidMissionError after MAX_ITERATIONS failed iterations. The analysis is done once per set of options:
+#
+#   - threat tuples and turn assignments are checked exactly, using the distribution tables which the
+#     generator uses anyway (ThreatTupleTable, TurnAssignmentTable),
+#   - threat times depend on the phase lengths and are estimated from a fixed number of seeded trials of
+#     makePhases and makeThreats.
+#
+# Check the options for 5 players with double actions and an override:
+#
+#   python3 feasibility.py -p 5 -2 -o maxTpPerPhase=4
+#
+import random
+
+import spacealert
+
+TRIALS = 200 # number of trials used to estimate the failure rates of threat times
+SEED = 0     # seed of the trials, so that the verdict for a set of options is reproducible
+
+
+class Analysis:
+    """Result of analyze for a set of options.
+
+    *rejectionRates* maps stages of MissionGenerator to the probability that one call of the stage fails:
+
+        - chooseThreatTuple: the probability of the random choices in ThreatTupleTable.enumerateChoices
+          that violate the constraints. These are excluded from the table, so they cost no attempts.
+        - assignThreatsToTurns: the probability of choosing a threat tuple which cannot be assigned to
+          turns (exact).
+        - chooseThreatTimes: the estimated probability that threat times cannot be placed (one call,
+          without retries).
+        - makeThreats: the estimated probability that an iteration of makeMission fails while choosing
+          threats (including all retries).
+
+    *errors* maps stages which can never succeed to an error message. *missionFailureProbability* is the
+    estimated probability that makeSeededMission raises an InvalidMissionError because all MAX_ITERATIONS
+    iterations fail (only counting failures of the stages above).
+    """
+    def __init__(self, options):
+        self.options = options
+        self.rejectionRates = {}
+        self.errors = {}
+        self.trials = 0
+        self.missionFailureProbability = 0.
+
+    @property
+    def feasible(self):
+        """Whether missions can be generated with these options."""
+        return len(self.errors) == 0
+
+    def asDict(self):
+        return {'feasible': self.feasible,
+                'rejectionRates': self.rejectionRates,
+                'errors': self.errors,
+                'trials': self.trials,
+                'missionFailureProbability': self.missionFailureProbability}
+
+    def report(self):
+        """Return a text report with one line per stage."""
+        lines = ["Options are {}feasible.".format('' if self.feasible else 'NOT ')]
+        for stage in ('choosePhaseLengths', 'chooseThreatTuple', 'assignThreatsToTurns', 'chooseThreatTimes',
+                      'makeThreats'):
+            if stage in self.errors:
+                lines.append("{:>22}: {}".format(stage, self.errors[stage]))
+            elif stage in self.rejectionRates:
+                lines.append("{:>22}: rejection rate {:.2%}".format(stage, self.rejectionRates[stage]))
+        if self.feasible:
+            lines.append("Probability that a mission cannot be generated in {} iterations: {:.1e}"
+                         .format(spacealert.MAX_ITERATIONS, self.missionFailureProbability))
+        return '\n'.join(lines)
+
+
+_analyses = {}
+
+def analyze(options):
+    """Return the Analysis of *options*. The result is computed only once for each frozen form of the
+    options (see Options.freeze)."""
+    key = options.freeze()
+    analysis = _analyses.get(key)
+    if analysis is None:
+        analysis = _analyses.setdefault(key, _analyze(options))
+    return analysis
+
+
+def check(options):
+    """Raise a ValueError describing the problems if missions cannot be generated with *options*."""
+    analysis = analyze(options)
+    if not analysis.feasible:
+        raise ValueError("Invalid options: " + '; '.join("{}: {}".format(stage, message)
+                                                          for stage, message in analysis.errors.items()))
+
+
+def _analyze(options):
+    analysis = Analysis(options)
+    try:
+        tupleTable = spacealert.getThreatTupleTable(options)
+    except ValueError as e:
+        analysis.errors['chooseThreatTuple'] = str(e)
+        return analysis
+    analysis.rejectionRates['chooseThreatTuple'] = tupleTable.failureProbability
+
+    unassignable = []
+    rate = 0.
+    for threatTuple, p in tupleTable.probabilities.items():
+        table = spacealert.getTurnAssignmentTable(options, tupleTable.threatTuple(threatTuple))
+        if len(table.probabilities) == 0:
+            unassignable.append(threatTuple)
+            rate += p
+    analysis.rejectionRates['assignThreatsToTurns'] = rate
+    if len(unassignable) == len(tupleTable.probabilities):
+        analysis.errors['assignThreatsToTurns'] = "No threat tuple can be assigned to turns, e.g. {}" \
+                                                  .format(unassignable[0])
+        return analysis
+
+    # Threat times depend on random phase lengths, so estimate their failure rates from trials. Stage
+    # calls and failures are counted by the observer.
+    statistics = spacealert.StageStatistics()
+    generator = spacealert.MissionGenerator(options, statistics)
+    rng = random.Random(SEED)
+    failures = 0
+    for i in range(TRIALS):
+        mission = spacealert.Mission()
+        try:
+            generator.makePhases(mission, rng)
+        except ValueError as e:
+            analysis.errors['choosePhaseLengths'] = str(e)
+            return analysis
+        try:
+            generator.makeThreats(mission, rng)
+        except spacealert.InvalidMissionError:
+            failures += 1
+    analysis.trials = TRIALS
+    calls = statistics.calls['chooseThreatTimes']
+    if calls > 0:
+        failed = sum(statistics.failures['chooseThreatTimes'].values())
+        analysis.rejectionRates['chooseThreatTimes'] = failed / calls
+        if failed == calls:
+            message, count = statistics.failures['chooseThreatTimes'].most_common(1)[0]
+            analysis.errors['chooseThreatTimes'] = "Failed in all {} trials, e.g. {}".format(calls, message)
+    analysis.rejectionRates['makeThreats'] = failures / TRIALS
+    if failures == TRIALS and len(analysis.errors) == 0:
+        message = "Failed in all {} trials".format(TRIALS)
+        if len(statistics.failures['makeThreats']) > 0:
+            message += ", e.g. " + statistics.failures['makeThreats'].most_common(1)[0][0]
+        analysis.errors['makeThreats'] = message
+    analysis.missionFailureProbability = (failures / TRIALS) ** spacealert.MAX_ITERATIONS
+    return analysis
+
+
+if __name__ == "__main__":
+    import argparse, json, sys
+    parser = argparse.ArgumentParser(description="Check whether missions can be generated with the given options.")
+    parser.add_argument("-p", "--players", type=int, choices=[4, 5], default=5, help="Number of players, defaults to 5.")
+    parser.add_argument('-2', "--double", action="store_true", help="Use the options for double actions.")
+    parser.add_argument('-o', "--option", type=str, action="append", help="Set the value of an arbitrary option using the format key=value.")
+    parser.add_argument('--json', action="store_true", help="Print the analysis as JSON.")
+    args = parser.parse_args()
+
+    if args.double:
+        options = spacealert.Options.createDoubleActions(args.players)
+    else: options = spacealert.Options.create(args.players)
+    if args.option is not None:
+        options.update(**dict(keyEqValue.split('=') for keyEqValue in args.option))
+    analysis = analyze(options)
+    if args.json:
+        print(json.dumps(analysis.asDict(), indent=2, sort_keys=True))
+    else: print(analysis.report())
+    sys.exit(0 if analysis.feasible else 1)
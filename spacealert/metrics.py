@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Space Alert Misson Player at
+# https://github.com/MartinAltmayer/spacealert.
+#
+# Copyright 2015 Martin Altmayer
+# The Space Alert board game was created by Vlaada Chvátil.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Minimal metrics in the Prometheus text exposition format
+# (https://prometheus.io/docs/instrumenting/exposition_formats/). Metrics have a fixed list of label
+# names; the values of the labels are passed as a tuple to inc, set and observe. Updating a metric only
+# takes a lock and increments a number, so metrics can always be enabled.
+#
+import bisect, threading
+
+
+class Metric:
+    """Abstract base class of all metrics. *name* and *help* are the metric name and its description,
+    *labelNames* is a tuple of label names."""
+    type = None
+
+    def __init__(self, name, help, labelNames=()):
+        self.name = name
+        self.help = help
+        self.labelNames = tuple(labelNames)
+        self.values = {} # tuple of label values -> value
+        self._lock = threading.Lock()
+
+    def replace(self, values):
+        """Replace all values. This is used for metrics whose values are collected from other objects
+        just before they are exposed. *values* maps tuples of label values to values."""
+        with self._lock:
+            self.values = dict(values)
+
+    def expose(self, constLabels=()):
+        """Return the lines of this metric in text exposition format. *constLabels* is a tuple of pairs
+        (name, value) of labels which are added to all values (compare Registry.constLabels)."""
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} {}".format(self.name, self.type)]
+        with self._lock:
+            items = sorted(self.values.items())
+        names = tuple(name for name, value in constLabels) + self.labelNames
+        constValues = tuple(value for name, value in constLabels)
+        for labels, value in items:
+            lines.extend(self._exposeValue(names, constValues + labels, value))
+        return lines
+
+    def _exposeValue(self, names, labels, value):
+        return ["{}{} {}".format(self.name, formatLabels(names, labels), formatNumber(value))]
+
+
+class Counter(Metric):
+    """A value that only increases, e.g. the number of requests."""
+    type = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that can go up and down, e.g. the number of requests in progress."""
+    type = 'gauge'
+
+    def set(self, labels=(), value=0):
+        with self._lock:
+            self.values[labels] = value
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+
+class Histogram(Metric):
+    """Distribution of observed values (e.g. latencies) in buckets given by their upper bounds. For each
+    combination of labels the count of each bucket, the sum and the total count are stored."""
+    type = 'histogram'
+    DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10.)
+
+    def __init__(self, name, help, labelNames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelNames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, labels=(), value=0.):
+        i = bisect.bisect_left(self.buckets, value) # buckets are inclusive upper bounds
+        with self._lock:
+            data = self.values.get(labels)
+            if data is None:
+                # counts of the buckets (not cumulative, the last one is +Inf), sum
+                data = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.]
+            data[0][i] += 1
+            data[1] += value
+
+    def _exposeValue(self, names, labels, data):
+        counts, total = data
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            lines.append("{}_bucket{} {}".format(self.name, formatLabels(names + ('le',), labels + (bound,)),
+                                                 cumulative))
+        labelString = formatLabels(names, labels)
+        lines.append("{}_sum{} {}".format(self.name, labelString, formatNumber(total)))
+        lines.append("{}_count{} {}".format(self.name, labelString, cumulative))
+        return lines
+
+
+class Registry:
+    """A set of metrics which are exposed together. *constLabels* is a tuple of pairs (name, value) of
+    labels which are added to all metrics, e.g. to tell several processes apart."""
+    def __init__(self, constLabels=()):
+        self.metrics = []
+        self.constLabels = tuple(constLabels)
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelNames=()):
+        return self.add(Counter(name, help, labelNames))
+
+    def gauge(self, name, help, labelNames=()):
+        return self.add(Gauge(name, help, labelNames))
+
+    def histogram(self, name, help, labelNames=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self.add(Histogram(name, help, labelNames, buckets))
+
+    def expose(self):
+        """Return all metrics in text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.expose(self.constLabels))
+        return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def formatNumber(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def formatLabels(names, values):
+    if len(names) == 0:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, escape(value)) for name, value in zip(names, values)) + '}'
+
+
+def escape(value):
+    if isinstance(value, float):
+        return formatNumber(value)
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
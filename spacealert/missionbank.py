@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Space Alert Misson Player at
+# https://github.com/MartinAltmayer/spacealert.
+#
+# Copyright 2015 Martin Altmayer
+# The Space Alert board game was created by Vlaada Chvátil.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import bisect, collections, random
+
+from missionpool import BackgroundFiller, keyName
+
+
+class MissionBank(BackgroundFiller):
+    """Pre-generated missions for each key in *keys*, sorted by a difficulty score, so that a mission
+    with a score in a given range can be found by bisection instead of generating missions until one
+    matches. *score* is called with a result of *factory* and returns its score (e.g.
+    Mission.difficulty).
+
+    A mission is handed out only once as long as the bank contains unused missions in the requested
+    range. Used missions are kept (up to *size* per key) and handed out again when the range is
+    exhausted. Whenever fewer than *lowWatermark* unused missions are left for a key, a background thread
+    refills the bank up to *size* unused missions (see BackgroundFiller).
+    """
+    def __init__(self, factory, keys, score, size=100, lowWatermark=None):
+        super().__init__(factory, keys, size, lowWatermark)
+        self.score = score
+        # For each key two parallel lists sorted by score: scores and missions
+        self.unused = {key: ([], []) for key in keys}
+        self.used = {key: ([], []) for key in keys}
+        self.hits = collections.Counter()     # key -> requests served with an unused mission in range
+        self.reuses = collections.Counter()   # key -> requests served with a used mission in range
+        self.nearest = collections.Counter()  # key -> requests served with the nearest mission out of range
+        self.misses = collections.Counter()   # key -> requests that had to wait for generation
+        self._random = random.Random()
+
+    def get(self, key, low=None, high=None):
+        """Return a mission for *key* whose score is in the range [*low*, *high*] (None means unbounded).
+        Prefer unused missions, then used ones. If the bank contains no mission in the range, return the
+        unused mission whose score is closest to it; if the bank is empty, generate a mission."""
+        with self._condition:
+            scores, missions = self.unused[key]
+            i, j = _range(scores, low, high)
+            if i < j:
+                self.hits[key] += 1
+                return self._take(key, self._random.randrange(i, j))
+            usedScores, usedMissions = self.used[key]
+            k, l = _range(usedScores, low, high)
+            if k < l:
+                self.reuses[key] += 1
+                return usedMissions[self._random.randrange(k, l)]
+            if len(scores) > 0:
+                # The range lies between scores[i-1] and scores[i] (or beyond the first or last score)
+                candidates = [c for c in (i-1, i) if 0 <= c < len(scores)]
+                self.nearest[key] += 1
+                return self._take(key, min(candidates, key=lambda c: _distance(scores[c], low, high)))
+            self.misses[key] += 1
+        return self.generate(key)
+
+    def scoreRange(self, key, lowQuantile, highQuantile):
+        """Return the scores (low, high) at the given quantiles (numbers between 0 and 1) of all missions
+        for *key* in the bank, used or not. Return (None, None) if the bank is empty."""
+        with self._condition:
+            scores = sorted(self.unused[key][0] + self.used[key][0])
+        if len(scores) == 0:
+            return None, None
+        def quantile(q):
+            return scores[min(int(q * len(scores)), len(scores)-1)]
+        return quantile(lowQuantile), quantile(highQuantile)
+
+    def stats(self):
+        """Return a dict with the configuration and, both per key and in total, the number of unused
+        missions and how requests were served. Keys are converted to strings like '4-double-wy'."""
+        with self._condition:
+            return {
+                'size': self.size,
+                'lowWatermark': self.lowWatermark,
+                'unused': sum(len(scores) for scores, missions in self.unused.values()),
+                'hits': sum(self.hits.values()),
+                'reuses': sum(self.reuses.values()),
+                'nearest': sum(self.nearest.values()),
+                'misses': sum(self.misses.values()),
+                'failures': sum(self.failures.values()),
+                'keys': {keyName(key): {'unused': len(scores),
+                                        'used': len(self.used[key][0]),
+                                        'minScore': scores[0] if len(scores) > 0 else None,
+                                        'maxScore': scores[-1] if len(scores) > 0 else None,
+                                        'hits': self.hits[key],
+                                        'reuses': self.reuses[key],
+                                        'nearest': self.nearest[key],
+                                        'misses': self.misses[key],
+                                        'failures': self.failures[key]}
+                         for key, (scores, missions) in self.unused.items()},
+            }
+
+    def _take(self, key, index):
+        # Must be called with the lock held. Move the unused mission at *index* to the used missions.
+        scores, missions = self.unused[key]
+        score = scores.pop(index)
+        mission = missions.pop(index)
+        usedScores, usedMissions = self.used[key]
+        position = bisect.bisect(usedScores, score)
+        usedScores.insert(position, score)
+        usedMissions.insert(position, mission)
+        if len(usedScores) > self.size:
+            # Forget a random used mission, so that all scores stay available for reuse
+            position = self._random.randrange(len(usedScores))
+            del usedScores[position]
+            del usedMissions[position]
+        self._checkRefill(key)
+        return mission
+
+    def stored(self, key):
+        return len(self.unused[key][0])
+
+    def _add(self, key, mission):
+        score = self.score(mission)
+        scores, missions = self.unused[key]
+        position = bisect.bisect(scores, score)
+        scores.insert(position, score)
+        missions.insert(position, mission)
+
+
+def _distance(score, low, high):
+    """Return the distance of *score* from the range [low, high]."""
+    if low is not None and score < low:
+        return low - score
+    if high is not None and score > high:
+        return score - high
+    return 0
+
+
+def _range(scores, low, high):
+    """Return the indices (i, j) such that scores[i:j] are the scores in [low, high]."""
+    i = bisect.bisect_left(scores, low) if low is not None else 0
+    j = bisect.bisect_right(scores, high) if high is not None else len(scores)
+    return i, max(i, j)
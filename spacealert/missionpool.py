@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Space Alert Misson Player at
+# https://github.com/MartinAltmayer/spacealert.
+#
+# Copyright 2015 Martin Altmayer
+# The Space Alert board game was created by Vlaada Chvátil.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import collections, threading
+
+import spacealert
+
+
+class BackgroundFiller:
+    """Base class of MissionPool and MissionBank: Missions for each key in *keys* which are generated in
+    advance by a background thread. *factory* is called with a key and must return a new mission or raise
+    InvalidMissionError (or RuntimeError); it should retry failed attempts itself (like
+    makeSeededMission). The filler does not look into the missions, so the factory may return additional
+    data, e.g. pairs (seed, mission). Whenever fewer than *lowWatermark* missions are stored for a key,
+    the background thread generates missions until *size* missions are stored.
+
+    Subclasses store the missions and must implement stored and _add. They must call _checkRefill
+    whenever they remove missions. *_condition* protects all data of the filler and its subclass.
+    """
+    def __init__(self, factory, keys, size=10, lowWatermark=None):
+        self.factory = factory
+        self.size = size
+        self.lowWatermark = lowWatermark if lowWatermark is not None else (size+1) // 2
+        self.failures = collections.Counter() # key -> number of missions that could not be generated
+        self._refill = collections.OrderedDict((key, True) for key in keys) # keys that need refilling
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def start(self):
+        """Start the background thread which generates missions."""
+        if self._thread is None and self.size > 0:
+            self._thread = threading.Thread(target=self._run, name=type(self).__name__)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """Stop the background thread (it will finish the mission it is currently generating)."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def generate(self, key):
+        """Generate a new mission for *key*. Count and re-raise the error if the factory fails."""
+        try:
+            return self.factory(key)
+        except (RuntimeError, spacealert.InvalidMissionError):
+            with self._condition:
+                self.failures[key] += 1
+            raise
+
+    def stored(self, key):
+        """Return the number of stored missions for *key* which count towards *size*. Must be called
+        with the lock held."""
+        raise NotImplementedError()
+
+    def _add(self, key, mission):
+        """Store a mission generated by the background thread. Must be called with the lock held."""
+        raise NotImplementedError()
+
+    def _checkRefill(self, key):
+        # Must be called with the lock held. Wake up the background thread if *key* needs refilling.
+        if self.stored(key) < self.lowWatermark and key not in self._refill:
+            self._refill[key] = True
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped and len(self._refill) == 0:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                key = next(iter(self._refill))
+                if self.stored(key) >= self.size:
+                    del self._refill[key]
+                    continue
+            try:
+                mission = self.generate(key)
+            except (RuntimeError, spacealert.InvalidMissionError) as e:
+                # Do not block the other keys. Requests for this key will generate missions themselves.
+                print("{}: cannot generate missions for {}: {}".format(type(self).__name__, key, e))
+                with self._condition:
+                    del self._refill[key]
+                continue
+            with self._condition:
+                self._add(key, mission)
+                # Round-robin: move the key to the end so that all keys are filled evenly.
+                self._refill.move_to_end(key)
+
+
+class MissionPool(BackgroundFiller):
+    """A bounded pool of ready missions for each key in *keys*, which is kept filled by a background
+    thread (see BackgroundFiller). Missions are handed out in the order in which they were generated.
+    """
+    def __init__(self, factory, keys, size=10, lowWatermark=None):
+        super().__init__(factory, keys, size, lowWatermark)
+        self.missions = {key: collections.deque() for key in keys}
+        self.hits = collections.Counter()     # key -> number of requests served from the pool
+        self.misses = collections.Counter()   # key -> number of requests that had to wait for generation
+
+    def get(self, key):
+        """Return a mission for *key*. Take it from the pool if possible, otherwise generate it."""
+        with self._condition:
+            missions = self.missions.get(key)
+            if missions:
+                self.hits[key] += 1
+                mission = missions.popleft()
+                self._checkRefill(key)
+                return mission
+            self.misses[key] += 1
+        return self.generate(key)
+
+    def stats(self):
+        """Return a dict with the configuration, the number of ready missions, hits, misses and failures
+        (both per key and in total). Keys are converted to strings like '4-double-wy'."""
+        with self._condition:
+            return {
+                'size': self.size,
+                'lowWatermark': self.lowWatermark,
+                'ready': sum(len(missions) for missions in self.missions.values()),
+                'hits': sum(self.hits.values()),
+                'misses': sum(self.misses.values()),
+                'failures': sum(self.failures.values()),
+                'keys': {keyName(key): {'ready': len(missions),
+                                        'hits': self.hits[key],
+                                        'misses': self.misses[key],
+                                        'failures': self.failures[key]}
+                         for key, missions in self.missions.items()},
+            }
+
+    def stored(self, key):
+        return len(self.missions[key])
+
+    def _add(self, key, mission):
+        self.missions[key].append(mission)
+
+
+def keyName(key):
+    """Convert a key (players, double, difficulty) to a string like '4-double-wy' for statistics."""
+    return '-'.join(str(k) if not isinstance(k, bool) else ('double' if k else 'normal') for k in key)
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Space Alert Misson Player at
+# https://github.com/MartinAltmayer/spacealert.
+#
+# Copyright 2015 Martin Altmayer
+# The Space Alert board game was created by Vlaada Chvátil.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Mission scripts have the format used in scripts.py: The first line contains the ends of the (usually
+# three) phases, e.g. '3:45 - 7:30 - 10:00'. Each further line contains one event:
+#
+#   AL 0:10 T+2 ST White     alert (here: serious threat in zone white at turn 2)
+#   UA 0:55 T+3 IT           unconfirmed alert, only used with five players
+#   ID 2:20                  incoming data
+#   DT 3:05                  data transfer
+#   CD 2:50 - 3:00           communications down
+#
+# Empty lines and lines starting with '#' are ignored.
+#
+import os, threading
+
+import spacealert
+from spacealert import Phase, Alert, IncomingData, DataTransfer, CommunicationsDown, parseTime
+
+
+class ScriptError(ValueError):
+    """Raised when a mission script is invalid. The message contains script name and line number."""
+    def __init__(self, name, lineNumber, message):
+        super().__init__("Script '{}', line {}: {}".format(name, lineNumber, message))
+        self.name = name
+        self.lineNumber = lineNumber
+
+
+class MissionTemplate:
+    """Parsed and validated mission script. *phaseEnds* is a tuple containing the ends of the phases in
+    seconds, *events* is a tuple of tuples (code, start, ...) where code is one of the two-letter codes
+    of the script format and the remaining items are
+
+        - for 'AL' and 'UA': turn, threat type, zone (None for internal threats)
+        - for 'CD': duration
+        - nothing for 'ID' and 'DT'.
+
+    Templates must not be modified. Use mission() to get a Mission.
+    """
+    __slots__ = ('name', 'phaseEnds', 'events')
+
+    def __init__(self, name, phaseEnds, events):
+        self.name = name
+        self.phaseEnds = phaseEnds
+        self.events = events
+
+    def __repr__(self):
+        return "MissionTemplate({})".format(self.name)
+
+    @staticmethod
+    def parse(name, text):
+        """Parse a mission script. Raise a ScriptError if it is invalid."""
+        phaseEnds = None
+        events = []
+        for lineNumber, line in enumerate(text.split('\n'), start=1):
+            line = line.strip()
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            try:
+                if phaseEnds is None:
+                    phaseEnds = MissionTemplate._parsePhases(line)
+                else:
+                    event = MissionTemplate._parseEvent(line)
+                    if not 0 <= event[1] < phaseEnds[-1]:
+                        raise ValueError("Event starts after the end of the mission.")
+                    if event[0] == 'CD' and event[1] + event[2] > phaseEnds[-1]:
+                        raise ValueError("Event ends after the end of the mission.")
+                    events.append(event)
+            except ValueError as e:
+                raise ScriptError(name, lineNumber, e) from None
+        if phaseEnds is None:
+            raise ScriptError(name, 1, "Script is empty.")
+        return MissionTemplate(name, phaseEnds, tuple(events))
+
+    @staticmethod
+    def _parsePhases(line):
+        phaseEnds = tuple(parseScriptTime(time) for time in line.split(' - '))
+        if len(phaseEnds) > 3:
+            raise ValueError("Expected the ends of at most three phases like '3:45 - 7:30 - 10:00'.")
+        if any(end <= start for start, end in zip((0,) + phaseEnds, phaseEnds)):
+            raise ValueError("Phase ends must be increasing.")
+        return phaseEnds
+
+    @staticmethod
+    def _parseEvent(line):
+        parts = line.split()
+        code = parts[0]
+        if code in ('AL', 'UA'):
+            if len(parts) not in (4, 5):
+                raise ValueError("Expected an alert like 'AL 0:10 T+2 ST White'.")
+            start = parseScriptTime(parts[1])
+            if not parts[2].startswith('T+') or not parts[2][2:].isdigit() or not 1 <= int(parts[2][2:]) <= 8:
+                raise ValueError("Invalid turn '{}', expected T+1 to T+8.".format(parts[2]))
+            turn = int(parts[2][2:])
+            threatType = spacealert.getThreatType(parts[3])
+            if threatType.internal:
+                if len(parts) == 5:
+                    raise ValueError("Internal threats must not have a zone.")
+                zone = None
+            elif len(parts) == 5:
+                zone = spacealert.getZoneByName(parts[4])
+            else: raise ValueError("External threats need a zone.")
+            return (code, start, turn, threatType, zone)
+        elif code in ('ID', 'DT'):
+            if len(parts) != 2:
+                raise ValueError("Expected '{} <time>'.".format(code))
+            return (code, parseScriptTime(parts[1]))
+        elif code == 'CD':
+            if len(parts) != 4 or parts[2] != '-':
+                raise ValueError("Expected communications down like 'CD 2:50 - 3:00'.")
+            start, end = parseScriptTime(parts[1]), parseScriptTime(parts[3])
+            if end <= start:
+                raise ValueError("Communications down must end after it starts.")
+            return (code, start, end - start)
+        else: raise ValueError("Unknown event code '{}'.".format(code))
+
+    def mission(self, players, difficulty):
+        """Return a new Mission for the given number of players and difficulty ('w', 'y' or 'r')."""
+        mission = spacealert.Mission()
+        start = 0
+        for i, end in enumerate(self.phaseEnds, start=1):
+            mission.addPhase(Phase(i, start, end - start))
+            start = end
+        for event in self.events:
+            code = event[0]
+            if code in ('AL', 'UA'):
+                if code == 'AL' or players == 5:
+                    code, time, turn, threatType, zone = event
+                    mission.addEvent(Alert(time, turn, threatType, zone, difficulty=difficulty))
+            elif code == 'ID':
+                mission.addEvent(IncomingData(event[1]))
+            elif code == 'DT':
+                mission.addEvent(DataTransfer(event[1]))
+            else: mission.addEvent(CommunicationsDown(event[1], event[2]))
+        return mission
+
+
+def parseScriptTime(string):
+    """Like spacealert.parseTime, but raise a ValueError with a clear message for invalid times."""
+    minutes, colon, seconds = string.partition(':')
+    if not minutes.isdigit() or colon and not (seconds.isdigit() and int(seconds) < 60):
+        raise ValueError("Invalid time '{}', expected a time like '3:45'.".format(string))
+    return parseTime(string)
+
+
+class ScriptRegistry:
+    """Registry of mission templates by name. Scripts added via add are parsed immediately. Scripts
+    added via addFile or loadDirectory are only parsed on first access, so that large directories do
+    not slow down server startup (use validate to parse all of them at once).
+    """
+    EXTENSION = '.txt'
+
+    def __init__(self):
+        self._templates = {}
+        self._files = {} # name -> path of scripts that have not been parsed yet
+        self._lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self._templates or name in self._files
+
+    def names(self):
+        """Return a sorted list of all script names."""
+        return sorted(set(self._templates) | set(self._files))
+
+    def add(self, name, text):
+        """Parse and add a script. Replaces any script of the same name."""
+        template = MissionTemplate.parse(name, text)
+        with self._lock:
+            self._templates[name] = template
+            self._files.pop(name, None)
+        return template
+
+    def addFile(self, path, name=None):
+        """Add the script stored in the file *path*. The name defaults to the file name without
+        extension."""
+        if name is None:
+            name = os.path.splitext(os.path.basename(path))[0]
+        with self._lock:
+            self._files[name] = path
+            self._templates.pop(name, None)
+
+    def loadDirectory(self, path):
+        """Add all scripts (files ending with EXTENSION) within the directory *path*. Return their
+        names."""
+        names = []
+        for fileName in sorted(os.listdir(path)):
+            if fileName.endswith(self.EXTENSION):
+                self.addFile(os.path.join(path, fileName))
+                names.append(fileName[:-len(self.EXTENSION)])
+        return names
+
+    def get(self, name):
+        """Return the template of the given name. Raise a KeyError if there is no such script and a
+        ScriptError if it is invalid."""
+        template = self._templates.get(name)
+        if template is not None:
+            return template
+        with self._lock:
+            if name in self._templates:
+                return self._templates[name]
+            path = self._files[name]
+            with open(path, 'r', encoding='utf-8') as file:
+                template = MissionTemplate.parse(name, file.read())
+            self._templates[name] = template
+            del self._files[name]
+        return template
+
+    def mission(self, name, players, difficulty):
+        """Return a new Mission created from the script *name*."""
+        return self.get(name).mission(players, difficulty)
+
+    def validate(self):
+        """Parse all scripts that have not been parsed yet. Return a list of ScriptErrors."""
+        errors = []
+        for name in list(self._files):
+            try:
+                self.get(name)
+            except ScriptError as e:
+                errors.append(e)
+        return errors
+
+
+def _createRegistry():
+    import scripts
+    registry = ScriptRegistry()
+    for name, text in scripts.scripts.items():
+        if isinstance(text, str):
+            registry.add(name, text)
+    return registry
+
+# The builtin scripts from scripts.py are parsed once at import time.
+registry = _createRegistry()
+
+
+if __name__ == "__main__":
+    import argparse, sys
+    parser = argparse.ArgumentParser(description="Validate mission scripts.")
+    parser.add_argument('directories', nargs='*', help="Directories containing scripts (*.txt).")
+    args = parser.parse_args()
+    for directory in args.directories:
+        registry.loadDirectory(directory)
+    errors = registry.validate()
+    for error in errors:
+        print(error)
+    print("{} scripts, {} errors.".format(len(registry.names()), len(errors)))
+    sys.exit(1 if errors else 0)
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Space Alert Misson Player at
+# https://github.com/MartinAltmayer/spacealert.
+#
+# Copyright 2015 Martin Altmayer
+# The Space Alert board game was created by Vlaada Chvátil.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import collections, functools, multiprocessing, time, json
+
+import spacealert
+
+# Number of missions generated by one task in a worker process. Shards are seeded independently, so the
+# result for a given seed does not depend on the number of workers.
+SHARD_SIZE = 1000
+
+
+class MissionStatistics:
+    """Histograms over a set of missions. The memory used does not depend on the number of missions,
+    because only counters are stored. Statistics of several sets of missions can be combined via merge.
+    """
+    HISTOGRAMS = ['threatTuples', 'turns', 'zones', 'ambushes', 'phaseLengths', 'commDown', 'difficulties']
+
+    def __init__(self):
+        self.missions = 0      # number of generated missions
+        self.failures = 0      # number of missions that could not be generated
+        self.cpuTime = 0.      # CPU seconds used for generation (summed over all workers)
+        self.wallTime = 0.     # wall clock seconds (only set by collectStatistics)
+        self.threatTuples = collections.Counter() # (T, IT, ST, SIT) -> count
+        self.turns = collections.Counter()        # (threat type code, turn) -> count
+        self.zones = collections.Counter()        # zone name -> count
+        self.ambushes = collections.Counter()     # phase number -> count
+        self.phaseLengths = collections.Counter() # (phase number, length) -> count
+        self.commDown = collections.Counter()     # total seconds of communications down -> count
+        self.difficulties = collections.Counter() # Mission.difficulty() -> count
+
+    def add(self, mission):
+        """Add a mission to the statistics."""
+        self.missions += 1
+        counters = {tt: 0 for tt in spacealert.THREAT_TYPES}
+        commDown = 0
+        for event in mission.events:
+            if isinstance(event, spacealert.Alert):
+                counters[event.type] += 1
+                self.turns[event.type.code, event.turn] += 1
+                if event.zone is not None:
+                    self.zones[event.zone.name] += 1
+                if event.ambush:
+                    self.ambushes[event.phase.number] += 1
+            elif isinstance(event, spacealert.CommunicationsDown):
+                commDown += event.duration
+        self.threatTuples[tuple(counters[tt] for tt in spacealert.THREAT_TYPES)] += 1
+        for phase in mission.phases:
+            self.phaseLengths[phase.number, phase.length] += 1
+        self.commDown[commDown] += 1
+        self.difficulties[mission.difficulty()] += 1
+
+    def merge(self, other):
+        """Add the statistics of *other* to this object."""
+        self.missions += other.missions
+        self.failures += other.failures
+        self.cpuTime += other.cpuTime
+        for name in self.HISTOGRAMS:
+            getattr(self, name).update(getattr(other, name))
+
+    @property
+    def throughput(self):
+        """Missions per wall clock second (or per CPU second if the wall time is unknown)."""
+        seconds = self.wallTime or self.cpuTime
+        return (self.missions + self.failures) / seconds if seconds > 0 else 0.
+
+    def meanDifficulty(self):
+        if self.missions == 0:
+            return 0.
+        return sum(d * count for d, count in self.difficulties.items()) / self.missions
+
+    def asDict(self):
+        """Return the statistics as a dict which can be serialized to JSON."""
+        def nested(counter):
+            result = {}
+            for (a, b), count in sorted(counter.items()):
+                result.setdefault(str(a), {})[str(b)] = count
+            return result
+        def simple(counter):
+            return {str(k): v for k, v in sorted(counter.items())}
+        return {
+            'missions': self.missions,
+            'failures': self.failures,
+            'cpuTime': self.cpuTime,
+            'wallTime': self.wallTime,
+            'throughput': self.throughput,
+            'meanDifficulty': self.meanDifficulty(),
+            'threatTuples': {'-'.join(map(str, k)): v for k, v in sorted(self.threatTuples.items())},
+            'turns': nested(self.turns),
+            'zones': simple(self.zones),
+            'ambushes': simple(self.ambushes),
+            'phaseLengths': nested(self.phaseLengths),
+            'commDown': simple(self.commDown),
+            'difficulties': simple(self.difficulties),
+        }
+
+    def toJSON(self):
+        return json.dumps(self.asDict(), indent=2)
+
+    def report(self, alertCounters=False):
+        """Return a text report. If *alertCounters* is true, include the histograms of alerts (threat
+        tuples, turns, zones and ambushes)."""
+        lines = ["Missions: {}   Failures: {}   Mean difficulty: {:.2f}"
+                 .format(self.missions, self.failures, self.meanDifficulty()),
+                 "Time: {:.2f}s (CPU: {:.2f}s)   Throughput: {:.0f} missions/s"
+                 .format(self.wallTime, self.cpuTime, self.throughput)]
+
+        def histogram(title, counter, format=str):
+            lines.append('')
+            lines.append(title)
+            total = sum(counter.values())
+            for key, count in sorted(counter.items()):
+                lines.append("  {:>16}: {:>9} ({:5.1f}%)".format(format(key), count, 100 * count / total))
+
+        if alertCounters:
+            histogram("Threat tuples (T, IT, ST, SIT)", self.threatTuples)
+            histogram("Turns", self.turns, lambda k: "{} T+{}".format(*k))
+            histogram("Zones", self.zones)
+            histogram("Ambushes per phase", self.ambushes, lambda k: "Phase {}".format(k))
+        histogram("Phase lengths", self.phaseLengths, lambda k: "Phase {} {}:{:02}".format(k[0], *divmod(k[1], 60)))
+        histogram("Communications down (seconds)", self.commDown)
+        histogram("Difficulty", self.difficulties)
+        return '\n'.join(lines)
+
+
+def collectShard(options, args):
+    """Generate a shard of missions and return its MissionStatistics. *args* is a pair (seed, number)."""
+    seed, number = args
+    stats = MissionStatistics()
+    start = time.process_time()
+    for missionSeed in spacealert.missionSeeds(seed, number):
+        try:
+            mission = spacealert.makeSeededMission(options, missionSeed)
+        except spacealert.InvalidMissionError:
+            stats.failures += 1
+        else:
+            stats.add(mission)
+    stats.cpuTime = time.process_time() - start
+    return stats
+
+
+def collectStatistics(options, number, workers=None, seed=None):
+    """Generate *number* missions using *options* in a pool of *workers* processes (default: one per CPU)
+    and return their MissionStatistics."""
+    shardCount, rest = divmod(number, SHARD_SIZE)
+    shards = zip(spacealert.missionSeeds(seed, shardCount + 1),
+                 [SHARD_SIZE] * shardCount + [rest])
+    function = functools.partial(collectShard, options)
+
+    result = MissionStatistics()
+    start = time.perf_counter()
+    if workers == 1:
+        for stats in map(function, shards):
+            result.merge(stats)
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            for stats in pool.imap_unordered(function, shards):
+                result.merge(stats)
+    result.wallTime = time.perf_counter() - start
+    return result
@@ -48,7 +48,9 @@ function MissionAnimator(events) {
     this.timer = null;
     
     this.center = new Point(ctx.canvas.width/2, 350);
-    this.audioManager = new AudioManager();
+    if (spriteSource != null)
+        this.audioManager = new SpriteAudioManager(spriteSource.tracks);
+    else this.audioManager = new AudioManager();
 
     this.play = function() {
         if (!this.timer) {
@@ -236,6 +238,95 @@ function AudioManager() {
     }  
 }
 
+// Plays tracks from the audio sprite (a single file containing all tracks, see audiosprite.py).
+// offsets maps each track to [start, duration] in seconds within the sprite.
+function SpriteAudioManager(offsets) {
+    this.tracks = null;
+    this.offsets = offsets;
+    this.audio = document.getElementById("audio-sprite");
+    this.segment = null; // [start, end] of the current track within the sprite
+    this.loop = false;
+    this.timer = null;
+    
+    this.setTracks = function(tracks) {
+        this.clear();
+        this.tracks = tracks.slice(); // copy! array will be modified in next
+        this.next();
+    }
+    
+    this.next = function() {
+        var track;
+        var length = null;
+        if (this.tracks != null && this.tracks.length > 0) {
+            track = this.tracks.shift();
+            if (track.substr(0, 5) == "noise") {
+                length = parseInt(track.substr(5));
+                track = "noise";
+            }
+            this.loop = false;
+        }
+        else {
+            track = "alarm5";
+            this.loop = true;
+        }
+        var offset = this.offsets[track];
+        var duration = length != null ? Math.min(length, offset[1]) : offset[1];
+        this.segment = [offset[0], offset[0] + duration];
+        this.audio.currentTime = offset[0];
+        this.play();
+    }
+    
+    this.play = function() {
+        if (this.segment != null) {
+            this.audio.play();
+            this.startTimer(this.segment[1] - this.audio.currentTime);
+        }
+    }
+    
+    this.startTimer = function(seconds) {
+        this.stopTimer();
+        var that = this;
+        this.timer = setTimeout(function() { that.segmentEnded(); }, Math.max(seconds, 0) * 1000);
+    }
+    
+    this.stopTimer = function() {
+        if (this.timer != null) {
+            clearTimeout(this.timer);
+            this.timer = null;
+        }
+    }
+    
+    this.segmentEnded = function() {
+        this.timer = null;
+        var remaining = this.segment[1] - this.audio.currentTime;
+        if (remaining > 0.05) // playback started late, e.g. because the sprite was still loading
+            this.startTimer(remaining);
+        else if (this.loop) {
+            this.audio.currentTime = this.segment[0];
+            this.startTimer(this.segment[1] - this.segment[0]);
+        }
+        else {
+            this.audio.pause();
+            this.next();
+        }
+    }
+    
+    this.pause = function() {
+        this.stopTimer();
+        this.audio.pause();
+    }
+    
+    this.clear = function() {
+        this.pause();
+        this.segment = null;
+    }
+    
+    this.stop = function() {
+        this.clear();
+        this.tracks = null;
+    }
+}
+
 
 //========//
 // Events //
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Space Alert Misson Player at
+# https://github.com/MartinAltmayer/spacealert.
+#
+# Copyright 2015 Martin Altmayer
+# The Space Alert board game was created by Vlaada Chvátil.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Pre-forking: Mission generation is pure Python and holds the GIL, so threads cannot use more than one
+# core. Instead, the server can fork several worker processes which accept connections on the same port.
+# The parent process does not handle requests; it only restarts workers that die and stops all of them
+# when it receives SIGTERM or SIGINT. Only available on POSIX systems.
+#
+import os, sys, signal, socket, threading, time, traceback
+
+
+def isAvailable():
+    """Return whether worker processes can be forked on this platform."""
+    return hasattr(os, 'fork')
+
+
+def reusePortAvailable():
+    """Return whether several sockets may listen on the same port (SO_REUSEPORT). In this case the kernel
+    distributes new connections among the workers, otherwise they must share a single socket."""
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        return False
+    try:
+        with socket.socket() as sock:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        return True
+    except OSError:
+        return False
+
+
+class Supervisor:
+    """Run *count* worker processes and restart them when they exit. Each worker calls *target* with
+    its number (0 <= number < count); the worker exits with status 0 when *target* returns and with
+    status 1 if it raises an exception. Workers are told to stop with SIGTERM and should install a handler
+    for it (compare stopOnSignal).
+
+    Workers which die shortly after they were started are restarted with an exponentially growing
+    delay, so that a worker which crashes at startup does not keep the machine busy with forking.
+    """
+    POLL_INTERVAL = 0.1      # seconds between two checks for dead workers
+    MIN_RESTART_DELAY = 0.5  # delay before restarting a worker that crashed immediately...
+    MAX_RESTART_DELAY = 30.  # ...doubled for each further crash up to this value
+    STABLE_TIME = 60.        # a worker that lived this long is restarted without delay
+    STOP_TIMEOUT = 10.       # workers which have not stopped after this time are killed
+
+    def __init__(self, count, target):
+        self.count = count
+        self.target = target
+        self.workers = {}      # pid -> (number, start time)
+        self.delays = {}       # number -> current restart delay
+        self.restarts = {}     # number -> time at which the worker should be restarted
+        self.stopping = None   # time at which stop was called
+
+    def run(self):
+        """Start the workers and supervise them until stop is called (e.g. by a signal) and all workers
+        have exited."""
+        previous = {signum: signal.signal(signum, self._handleSignal)
+                    for signum in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            for number in range(self.count):
+                self.startWorker(number)
+            while self.stopping is None or len(self.workers) > 0:
+                self.reap()
+                now = time.monotonic()
+                if self.stopping is None:
+                    for number, due in list(self.restarts.items()):
+                        if due <= now:
+                            del self.restarts[number]
+                            self.startWorker(number)
+                elif now - self.stopping > self.STOP_TIMEOUT:
+                    self.signalWorkers(signal.SIGKILL)
+                time.sleep(self.POLL_INTERVAL)
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+
+    def stop(self):
+        """Tell all workers to stop. run will return when they have exited."""
+        if self.stopping is None:
+            self.stopping = time.monotonic()
+            self.restarts.clear()
+            self.signalWorkers(signal.SIGTERM)
+
+    def startWorker(self, number):
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                # The parent forwards SIGINT (e.g. Ctrl+C in the terminal, which reaches the whole process
+                # group) as SIGTERM. Restore the default for SIGTERM in case target installs no handler.
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                self.target(number)
+                status = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(status)
+        self.workers[pid] = (number, time.monotonic())
+        print("Started worker {} (pid {}).".format(number, pid))
+
+    def reap(self):
+        """Collect all workers that have exited and schedule their restart."""
+        while len(self.workers) > 0:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.workers.clear()
+                return
+            if pid == 0:
+                return
+            if pid not in self.workers:
+                continue
+            number, started = self.workers.pop(pid)
+            if self.stopping is not None:
+                continue
+            now = time.monotonic()
+            if now - started >= self.STABLE_TIME:
+                delay = 0.
+            else: delay = min(max(2 * self.delays.get(number, 0.), self.MIN_RESTART_DELAY),
+                              self.MAX_RESTART_DELAY)
+            self.delays[number] = delay
+            self.restarts[number] = now + delay
+            print("Worker {} (pid {}) {}, restarting in {:.1f}s."
+                  .format(number, pid, describeStatus(status), delay), file=sys.stderr)
+
+    def signalWorkers(self, signum):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _handleSignal(self, signum, frame):
+        self.stop()
+
+
+def describeStatus(status):
+    """Describe an exit status as returned by os.waitpid."""
+    if os.WIFSIGNALED(status):
+        try:
+            name = signal.Signals(os.WTERMSIG(status)).name
+        except ValueError:
+            name = str(os.WTERMSIG(status))
+        return "was killed by {}".format(name)
+    return "exited with status {}".format(os.WEXITSTATUS(status))
+
+
+def stopOnSignal(function):
+    """In a worker: Call *function* in a new thread when the supervisor sends SIGTERM. *function* should
+    make the worker's main loop return (e.g. HTTPServer.shutdown, which must not be called from the
+    thread running serve_forever)."""
+    def handler(signum, frame):
+        thread = threading.Thread(target=function)
+        thread.daemon = True
+        thread.start()
+    signal.signal(signal.SIGTERM, handler)
+
+
+def stopSupervisor():
+    """In a worker: Ask the supervisor to stop all workers (including this one)."""
+    os.kill(os.getppid(), signal.SIGTERM)
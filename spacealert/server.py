@@ -19,15 +19,79 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-import io, http.server, os
-import urllib.parse
-import spacealert
+import io, http.server, os, json, concurrent.futures, hashlib, random, time, socket, threading, collections
+import math, urllib.parse
+import spacealert, feasibility, missionpool, missionbank, bankfile, missionscripts, assets, audiosprite, accesslog, metrics, prefork
 
 htmlParts = {}
+missionPool = None
+missionBank = None
+bankFile = None # bankfile.BankReader of --bank-file
+assetCache = None
+accessLog = None
+scriptCache = {} # (script name, players, difficulty) -> (rendered player.htm, ETag)
+workerNumber = None # number of this process in --workers mode, None otherwise
+responseCache = None
 
-DIFFICULTIES = ['w', 'y', 'r', 'wy', 'wr', 'yr', 'wyr']
+# Random missions are generated from a seed (see spacealert.makeSeededMission), which is part of the URL.
+# Each mission uses its own random number generator, so missions can be generated in several threads.
+serverRandom = random.Random() # for everything else, e.g. new seeds
+SEED_BITS = 48     # new seeds are chosen from this many bits (larger seeds given in URLs are accepted)
+MAX_SEED = 2**64
+# Responses for a given seed never change (unless the server is updated, hence no longer max-age)
+CACHE_CONTROL_SEEDED = 'public, max-age=86400, immutable'
 
-def run(port=8000):
+API_MAX_MISSIONS = 10000 # maximal value of n in /api/missions?n=...
+# Values of the parameter 'challenge' and the corresponding ranges of difficulty scores in the mission bank
+# (as quantiles of the scores of all missions in the bank for the given settings)
+CHALLENGES = {'easy': (0., 1/3), 'normal': (1/3, 2/3), 'hard': (2/3, 1.)}
+
+# Values of the 'route' label of request metrics. Static files are grouped by directory, all other
+# paths are counted as 'other' (so that clients cannot create arbitrarily many time series).
+ROUTES = ('/', '/index.htm', '/player.htm', '/player.js', '/exit.htm', '/pool.json', '/bank.json', '/metrics',
+          '/api/mission', '/api/missions')
+ASSET_ROUTES = ('/audio/', '/images/', '/index.htm', '/player.js')
+
+metricRegistry = metrics.Registry()
+requestCount = metricRegistry.counter('spacealert_http_requests_total',
+                                      "HTTP requests by route and status code.", ('route', 'status'))
+requestLatency = metricRegistry.histogram('spacealert_http_request_duration_seconds',
+                                          "Time from reading the request to sending the last byte.", ('route',))
+requestsInFlight = metricRegistry.gauge('spacealert_http_requests_in_flight',
+                                        "Requests which are currently being handled.")
+assetBytes = metricRegistry.counter('spacealert_asset_bytes_total',
+                                    "Bytes sent for static files (including headers).", ('route',))
+generationLatency = metricRegistry.histogram('spacealert_generation_duration_seconds',
+                                             "Time to generate a random mission (successful attempts only).",
+                                             ('players', 'double', 'difficulty'))
+generationStageCalls = metricRegistry.counter('spacealert_generation_stage_calls_total',
+                                              "Calls of each stage of MissionGenerator (see "
+                                              "MissionGenerator.STAGES), including retries.", ('stage',))
+generationStageFailures = metricRegistry.counter('spacealert_generation_stage_failures_total',
+                                                 "Failed calls of each stage of MissionGenerator by error type. "
+                                                 "Failed stages are retried (see Options.stageRetries); "
+                                                 "failures of 'makeMission' are missions that could not be "
+                                                 "generated at all.", ('stage', 'error'))
+generationIterations = metricRegistry.histogram('spacealert_generation_iterations',
+                                                "Iterations of makeMission (i.e. choices of phases) needed to "
+                                                "generate a random mission.",
+                                                buckets=(1, 2, 3, 5, 10, 20, 50, spacealert.MAX_ITERATIONS))
+poolReady = metricRegistry.gauge('spacealert_pool_ready_missions', "Pre-generated missions in the pool.",
+                                 ('players', 'double', 'difficulty'))
+responseCacheRequests = metricRegistry.counter('spacealert_response_cache_requests_total',
+                                              "Requests for seeded missions by whether the rendered response "
+                                              "was cached.", ('result',))
+poolRequests = metricRegistry.counter('spacealert_pool_requests_total',
+                                      "Requests for pool missions which were served from the pool (hit) or "
+                                      "had to wait for generation (miss).", ('result',))
+
+def run(port=8000, mode='threaded', threads=16, poolSize=10, poolLowWatermark=None, scripts=None,
+        logMode='full', logFile=None, logSampleRate=0.1, workers=0, cacheSize=1000, bankSize=50,
+        bankLowWatermark=None, bankPath=None):
+    """Run the server until /exit.htm is requested. If *workers* is positive, fork this many server
+    processes (see prefork.py) after loading the static files. They either listen on the same port via
+    SO_REUSEPORT or accept connections from a single socket created before forking. If *bankPath* is
+    given, random missions are taken from this mission bank file (see bankfile.py)."""
     with open('player.htm', 'r') as htmlFile:
         html = htmlFile.read()
         pos1 = html.index("/* BEGIN */")
@@ -36,10 +100,253 @@ def run(port=8000):
         htmlParts['body'] = html[pos2+len("/* END */"):].encode('utf-8')
         del html
     
-    server_address = ('', port)
-    httpd = http.server.HTTPServer(server_address, RequestHandler)
-    httpd.serve_forever()
+    if scripts is not None:
+        names = missionscripts.registry.loadDirectory(scripts)
+        print("Found {} scripts in {}.".format(len(names), scripts))
+    
+    global missionPool, assetCache, bankFile
+    # Reject invalid options now instead of failing each request. This also computes the distribution
+    # tables before workers are forked.
+    for key in spacealert.MISSION_KEYS:
+        try:
+            feasibility.check(spacealert.makeOptions(*key))
+        except ValueError as e:
+            raise ValueError("Cannot generate missions for {}: {}".format(key, e)) from None
+    
+    assetCache = assets.AssetCache(os.getcwd())
+    assetCache.load()
+    print("Loaded {} static files ({:.1f} MB).".format(len(assetCache.assets), assetCache.totalSize() / 2**20))
+    loadAudioSprites()
+    
+    if bankPath is not None:
+        # The file is memory-mapped before forking, so that all workers share its pages
+        bankFile = bankfile.BankReader(bankPath)
+        print("Opened mission bank file with {} missions.".format(len(bankFile)))
+    
+    args = (poolSize, poolLowWatermark, logMode, logFile, logSampleRate, cacheSize, bankSize, bankLowWatermark)
+    if workers <= 0:
+        serve(makeServer(port, mode, threads), *args)
+        return
+    if not prefork.isAvailable():
+        raise RuntimeError("--workers is not supported on this platform.")
+    httpd = None
+    if prefork.reusePortAvailable():
+        print("Starting {} workers listening on port {} (SO_REUSEPORT).".format(workers, port))
+        def target(number):
+            startWorker(number)
+            serve(makeServer(port, mode, threads, reusePort=True), *args)
+    else:
+        # Bind before forking; the workers accept connections from the inherited socket. The executor of
+        # ThreadPoolHTTPServer starts its threads lazily, so no threads are forked.
+        print("Starting {} workers sharing a socket on port {}.".format(workers, port))
+        httpd = makeServer(port, mode, threads)
+        def target(number):
+            startWorker(number)
+            serve(httpd, *args)
+    try:
+        prefork.Supervisor(workers, target).run()
+    finally:
+        if httpd is not None:
+            httpd.server_close()
+        
+        
+def makeServer(port, mode='threaded', threads=16, reusePort=False):
+    """Return an HTTP server listening on *port*. If *reusePort* is true, other processes may listen on
+    the same port (they must set this flag, too)."""
+    if mode == 'threaded':
+        httpd = ThreadPoolHTTPServer(('', port), RequestHandler, threads, bind_and_activate=False)
+    else: httpd = http.server.HTTPServer(('', port), RequestHandler, bind_and_activate=False)
+    try:
+        if reusePort:
+            httpd.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        httpd.server_bind()
+        httpd.server_activate()
+    except:
+        httpd.server_close()
+        raise
+    return httpd
+    
+    
+def startWorker(number):
+    """Called in a forked worker process with its number."""
+    global workerNumber
+    workerNumber = number
+    # Each worker has its own metrics (and mission pool), so let scrapers tell them apart
+    metricRegistry.constLabels = (('worker', str(number)),)
+    
+    
+def serve(httpd, poolSize=10, poolLowWatermark=None, logMode='full', logFile=None, logSampleRate=0.1,
+          cacheSize=1000, bankSize=50, bankLowWatermark=None):
+    """Start the mission pool, the mission bank and the access log and handle requests with *httpd*
+    until it is shut down. In --workers mode this runs in each worker, because threads do not survive
+    fork."""
+    global missionPool, missionBank, accessLog, responseCache
+    responseCache = ResponseCache(cacheSize)
+    missionPool = missionpool.MissionPool(generateMission, spacealert.MISSION_KEYS, poolSize, poolLowWatermark)
+    missionPool.start()
+    missionBank = missionbank.MissionBank(generateMission, spacealert.MISSION_KEYS, lambda result: result[1].difficulty(),
+                                          bankSize, bankLowWatermark)
+    missionBank.start()
+    
+    file = open(logFile, 'a', encoding='utf-8') if logFile is not None and logMode != 'off' else None
+    accessLog = accesslog.AccessLog(logMode, file, logSampleRate)
+    accessLog.start()
+    
+    if workerNumber is not None:
+        prefork.stopOnSignal(httpd.shutdown)
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+        missionPool.stop()
+        missionBank.stop()
+        accessLog.stop()
+        if file is not None:
+            file.close()
+
+
+class ThreadPoolHTTPServer(http.server.HTTPServer):
+    """HTTP server that handles each connection in a pool of *threads* worker threads, so that a slow
+    client does not block everybody else. Connections that arrive while all workers are busy wait in the
+    pool's queue."""
+    request_queue_size = 64 # listen backlog, the default of 5 is too small when many tablets connect at once
+    
+    def __init__(self, server_address, handlerClass, threads=16, bind_and_activate=True):
+        super().__init__(server_address, handlerClass, bind_and_activate)
+        self.executor = concurrent.futures.ThreadPoolExecutor(threads, thread_name_prefix="http")
+        
+    def process_request(self, request, client_address):
+        self.executor.submit(self.processRequestInThread, request, client_address)
+        
+    def processRequestInThread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+
+class ResponseCache:
+    """LRU cache of rendered responses. Values are pairs (content, ETag). At most *size* responses are
+    kept."""
+    def __init__(self, size=1000):
+        self.size = size
+        self.responses = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        
+    def get(self, key):
+        """Return the response for *key* or None."""
+        with self._lock:
+            response = self.responses.get(key)
+            if response is not None:
+                self.responses.move_to_end(key)
+                self.hits += 1
+            else: self.misses += 1
+            return response
+        
+    def put(self, key, content):
+        """Store *content* (bytes) for *key* and return the pair (content, ETag)."""
+        response = (content, makeETag(content))
+        if self.size > 0:
+            with self._lock:
+                self.responses[key] = response
+                self.responses.move_to_end(key)
+                while len(self.responses) > self.size:
+                    self.responses.popitem(last=False)
+        return response
+
+
+def generateMission(key, seed=None):
+    """Generate a random mission. *key* is a tuple (players, double, difficulty). Return a tuple (seed,
+    mission), where the mission is determined by *key* and *seed*. If *seed* is None, a new seed is
+    chosen."""
+    if seed is None:
+        seed = serverRandom.getrandbits(SEED_BITS)
+    start = time.perf_counter()
+    statistics = spacealert.StageStatistics() # one per mission, so that threads do not share it
+    try:
+        mission = spacealert.makeSeededMission(spacealert.makeOptions(*key), seed, statistics)
+    except Exception as e:
+        # StageStatistics counts an error only for the innermost stage that raised it
+        generationStageFailures.inc(('makeMission', type(e).__name__))
+        raise
+    finally:
+        for stage, calls in statistics.calls.items():
+            generationStageCalls.inc((stage,), calls)
+        for (stage, error), count in statistics.errors.items():
+            generationStageFailures.inc((stage, error), count)
+    generationLatency.observe(keyLabels(key), time.perf_counter() - start)
+    generationIterations.observe((), statistics.calls['makePhases'])
+    return seed, mission
+
+
+def keyLabels(key):
+    """Return the label values of a key (players, double, difficulty) for metrics."""
+    players, double, difficulty = key
+    return (str(players), 'true' if double else 'false', difficulty)
+
+
+def updatePoolMetrics():
+    """Copy the current statistics of the mission pool to the metrics."""
+    poolReady.replace({keyLabels(key): len(missions) for key, missions in list(missionPool.missions.items())})
+    poolRequests.replace({('hit',): sum(missionPool.hits.values()), ('miss',): sum(missionPool.misses.values())})
+    responseCacheRequests.replace({('hit',): responseCache.hits, ('miss',): responseCache.misses})
+
+
+def routeOf(path):
+    """Return the value of the 'route' label for the URL path *path*."""
+    if path in ROUTES:
+        return path
+    for route in ('/audio/', '/images/'):
+        if path.startswith(route):
+            return route
+    return 'other'
+    
 
+def loadAudioSprites():
+    """Build the audio sprites (see audiosprite.py) and add them to the asset cache. The manifest is
+    embedded into each rendered player.htm, so that the player needs only one request for all audio."""
+    try:
+        sprites = audiosprite.build('audio')
+    except (OSError, audiosprite.AudioSpriteError) as e:
+        print("Cannot build audio sprites, the player will load each clip separately: {}".format(e))
+        htmlParts['audio'] = b"var audioSprite = null;\n\n"
+        return
+    for sprite in sprites:
+        assetCache.add('/audio/' + sprite.fileName, sprite.content, sprite.contentType)
+    manifest = json.dumps(audiosprite.manifest(sprites))
+    assetCache.add('/audio/sprite.json', manifest.encode('utf-8'))
+    htmlParts['audio'] = "var audioSprite = {};\n\n".format(manifest).encode('utf-8')
+    
+    
+def renderPlayer(mission):
+    """Return the content of player.htm for the given mission as bytes."""
+    javaScript = map(getJavaScript, mission.events)
+    content = ',\n'.join(s for s in javaScript if len(s) > 0)
+    return b''.join([htmlParts['header'],
+                     b"var events = [\n",
+                     content.encode('utf-8'),
+                     b"\n];\n\n",
+                     htmlParts['audio'],
+                     htmlParts['body']])
+
+
+def missionJSON(mission):
+    """Return the mission as compact JSON (bytes)."""
+    return json.dumps(mission.asDict(), separators=(',', ':')).encode('utf-8')
+
+
+def makeETag(content):
+    """Return a strong ETag for the given bytes."""
+    return '"{}"'.format(hashlib.sha1(content).hexdigest())
+    
 
 def getJavaScript(event):
     def b(x):
@@ -67,13 +374,63 @@ def getJavaScript(event):
 
 
 class RequestHandler(http.server.SimpleHTTPRequestHandler):
+    def setup(self):
+        super().setup()
+        self.wfile = accesslog.CountingWriter(self.wfile)
+        
+    def handle_one_request(self):
+        # Instead of the access log lines of the base class (log_request), write one record per request
+        # to the buffered access log.
+        start = time.perf_counter()
+        self.status = None
+        self.generationTime = None # seconds spent in getMission and rendering
+        self.error = None          # message passed to log_error
+        self.wfile.count = 0
+        self.inFlight = False
+        try:
+            super().handle_one_request()
+        finally:
+            if self.inFlight:
+                requestsInFlight.dec()
+        if self.status is not None:
+            latency = time.perf_counter() - start
+            path = getattr(self, 'path', None)
+            route = routeOf(urllib.parse.urlparse(path).path) if path is not None else 'other'
+            requestCount.inc((route, self.status))
+            requestLatency.observe((route,), latency)
+            if route in ASSET_ROUTES:
+                assetBytes.inc((route,), self.wfile.count)
+            if accessLog is not None:
+                accessLog.log(self.client_address[0], self.command, path, self.status,
+                              self.wfile.count, self.generationTime, latency, self.error)
+    
+    def parse_request(self):
+        if not super().parse_request():
+            return False
+        self.inFlight = True
+        requestsInFlight.inc()
+        return True
+    
+    def log_request(self, code='-', size='-'):
+        self.status = int(code)
+        
+    def log_error(self, format, *args):
+        # The message is added to the access log record of the request. Keep the first one, because
+        # send_error logs only its short message after handlers have logged the cause.
+        if self.error is None:
+            self.error = format % args
+        
+    def addGenerationTime(self, start):
+        """Add the time since *start* (a value of time.perf_counter) to the generation time of the
+        current request."""
+        self.generationTime = (self.generationTime or 0.) + time.perf_counter() - start
+    
     def isNormalFile(self, path):
         return path.startswith('/audio/') or path.startswith('/images/') \
                 or path in ['/index.htm', '/player.js']
     
     def doHelper(self, head=True):
         url = urllib.parse.urlparse(self.path)
-        print(self.path, url.path)
         if url.path != '/player.htm':
             if url.path == '/':
                 self.send_response(301)
@@ -84,30 +441,179 @@ class RequestHandler(http.server.SimpleHTTPRequestHandler):
                 self.send_response(200)
                 self.send_header("Content-type", "text/html")
                 self.end_headers()
-                # server shutdown must be called in a different thread
-                import threading
-                thread = threading.Thread(target=self.server.shutdown)
-                thread.daemon = True
-                thread.start()
+                if workerNumber is not None:
+                    prefork.stopSupervisor() # the supervisor stops all workers
+                else:
+                    # server shutdown must be called in a different thread
+                    thread = threading.Thread(target=self.server.shutdown)
+                    thread.daemon = True
+                    thread.start()
+                return False
+            elif url.path == '/pool.json':
+                self.sendContent(json.dumps(missionPool.stats()).encode('utf-8'), "application/json", head=head)
+                return False
+            elif url.path == '/bank.json':
+                self.sendContent(json.dumps(missionBank.stats()).encode('utf-8'), "application/json", head=head)
+                return False
+            elif url.path == '/metrics':
+                updatePoolMetrics()
+                self.sendContent(metricRegistry.expose().encode('utf-8'), metrics.CONTENT_TYPE, head=head)
+                return False
+            elif url.path == '/api/mission':
+                self.sendMission(url, head)
+                return False
+            elif url.path == '/api/missions':
+                self.sendMissionStream(url, head)
                 return False
             elif self.isNormalFile(url.path):
-                if head:
-                    super().do_HEAD()
-                    return False
-                else:
-                    super().do_GET()
-                    return False
+                self.sendAsset(url.path, head)
+                return False
             else:
                 self.send_error(404, "File not found")
                 return False
         return True
             
+    def etagMatches(self, etag):
+        """Return whether the request's If-None-Match header matches *etag*."""
+        header = self.headers.get('If-None-Match')
+        if header is None:
+            return False
+        tags = [tag.strip() for tag in header.split(',')]
+        return '*' in tags or etag in tags or 'W/'+etag in tags
+    
+    def sendContent(self, content, contentType, etag=None, cacheControl=None, head=False, headers=None):
+        """Send *content* (bytes) with the usual headers and the additional *headers* (a dict). If *etag*
+        is given and matches the request's If-None-Match header, send 304 Not Modified instead."""
+        notModified = etag is not None and self.etagMatches(etag)
+        self.send_response(304 if notModified else 200)
+        self.send_header("Content-type", contentType)
+        if etag is not None:
+            self.send_header("ETag", etag)
+        if cacheControl is not None:
+            self.send_header("Cache-Control", cacheControl)
+        if headers is not None:
+            for key, value in headers.items():
+                self.send_header(key, value)
+        if not notModified:
+            self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        if not notModified and not head:
+            self.wfile.write(content)
+        
+    def sendChunked(self, chunks, contentType, head=False):
+        """Send the byte strings from the iterable *chunks* as soon as they are produced. HTTP/1.1 clients
+        get chunked transfer encoding, HTTP/1.0 clients simply read until the connection is closed."""
+        chunked = self.request_version == 'HTTP/1.1'
+        if chunked:
+            self.protocol_version = 'HTTP/1.1'
+        self.send_response(200)
+        self.send_header("Content-type", contentType)
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        if head:
+            return
+        for chunk in chunks:
+            if len(chunk) == 0:
+                continue # an empty chunk would end the response
+            if chunked:
+                self.wfile.write(b'%x\r\n' % len(chunk) + chunk + b'\r\n')
+            else: self.wfile.write(chunk)
+        if chunked:
+            self.wfile.write(b'0\r\n\r\n')
+        
+    def acceptsGzip(self):
+        """Return whether the client accepts gzip-compressed responses."""
+        for coding in self.headers.get('Accept-Encoding', '').split(','):
+            name, _, params = coding.partition(';')
+            if name.strip().lower() == 'gzip':
+                return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+        return False
+        
+    def sendAsset(self, path, head=False):
+        """Send a static file from the asset cache, compressed if possible."""
+        asset = assetCache.get(path)
+        if asset is None:
+            self.send_error(404, "File not found")
+            return
+        if asset.gzipped is not None:
+            headers = {"Vary": "Accept-Encoding"}
+            if self.acceptsGzip():
+                headers["Content-Encoding"] = "gzip"
+                self.sendContent(asset.gzipped, asset.contentType, asset.gzipEtag, asset.cacheControl,
+                                 head, headers)
+                return
+        else:
+            # Uncompressed files (in particular audio) support range requests. Browsers need them to seek
+            # within the audio sprite.
+            headers = {"Accept-Ranges": "bytes"}
+            byteRange = self.requestedRange(asset)
+            if byteRange is not None:
+                self.sendRange(asset, byteRange, head)
+                return
+        self.sendContent(asset.content, asset.contentType, asset.etag, asset.cacheControl, head, headers)
+        
+    def requestedRange(self, asset):
+        """Return the byte range (start, end) requested via the Range header, where end is exclusive.
+        Return None if the whole file should be sent and 'invalid' if the range cannot be satisfied. Only
+        single ranges are supported."""
+        header = self.headers.get('Range')
+        if header is None or not header.startswith('bytes=') or ',' in header:
+            return None
+        ifRange = self.headers.get('If-Range')
+        if ifRange is not None and ifRange.strip() != asset.etag:
+            return None
+        first, dash, last = header[len('bytes='):].strip().partition('-')
+        length = len(asset.content)
+        try:
+            if first == '':
+                start, end = max(length - int(last), 0), length # suffix range: the last bytes
+            else:
+                start = int(first)
+                end = min(int(last) + 1, length) if last != '' else length
+        except ValueError:
+            return None
+        if not dash or start >= length or start >= end:
+            return 'invalid'
+        return start, end
+    
+    def sendRange(self, asset, byteRange, head=False):
+        """Send a part of *asset* as response to a range request (compare requestedRange)."""
+        length = len(asset.content)
+        if byteRange == 'invalid':
+            self.send_response(416)
+            self.send_header("Content-Range", "bytes */{}".format(length))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        start, end = byteRange
+        self.send_response(206)
+        self.send_header("Content-type", asset.contentType)
+        self.send_header("Content-Range", "bytes {}-{}/{}".format(start, end - 1, length))
+        self.send_header("ETag", asset.etag)
+        self.send_header("Cache-Control", asset.cacheControl)
+        self.send_header("Content-Length", str(end - start))
+        self.end_headers()
+        if not head:
+            self.wfile.write(memoryview(asset.content)[start:end])
+        
     def do_HEAD(self):
         if self.doHelper(head=True):
             self.send_response(200)
             self.send_header("Content-type", "text/html")
             self.end_headers()
         
+    def redirectToSeed(self, url, seed):
+        """Redirect to *url* with the parameter seed set to *seed*."""
+        query = [(k, v) for k, v in urllib.parse.parse_qsl(url.query) if k != 'seed']
+        query.append(('seed', str(seed)))
+        self.send_response(302)
+        self.send_header('Location', '{}?{}'.format(url.path, urllib.parse.urlencode(query)))
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        
     def parseGetParams(self, url):
         p = urllib.parse.parse_qs(url.query) # p maps to lists
         p = {k: v[-1] for k,v in p.items()}  # but we need each param only once
@@ -123,20 +629,139 @@ class RequestHandler(http.server.SimpleHTTPRequestHandler):
         double = p.get('double') in ['on', '1'] # only relevant if random is True
         
         difficulty = p.get('difficulty')
-        if difficulty not in DIFFICULTIES:
+        if difficulty not in spacealert.DIFFICULTIES:
             difficulty = 'w'
         
         if not random:
             script = p.get('script')
         else: script = None
         
+        seed = p.get('seed') # only relevant if random is True
+        if seed is not None and seed.isdigit() and len(seed) <= 20 and int(seed) < MAX_SEED:
+            seed = int(seed)
+        else: seed = None
+        
+        # Range of difficulty scores (see Mission.difficulty), either relative to the mission bank
+        # (challenge) or explicit. Only relevant if random is True and no seed is given.
+        challenge = p.get('challenge')
+        if challenge not in CHALLENGES:
+            challenge = None
+        scores = []
+        for name in ('minScore', 'maxScore'):
+            try:
+                score = float(p[name])
+                scores.append(score if math.isfinite(score) else None)
+            except (KeyError, ValueError):
+                scores.append(None)
+        
         return {'random': random,
                 'players': players,
                 'double': double,
                 'difficulty': difficulty,
                 'script': script,
+                'seed': seed,
+                'challenge': challenge,
+                'minScore': scores[0],
+                'maxScore': scores[1],
                 }
         
+    def getMission(self, params, fromPool=True):
+        """Return a tuple (seed, mission) for the GET parameters *params* (see parseGetParams). The seed
+        is None for scripted missions. Random missions without a seed are taken from the mission bank file
+        if there is one and otherwise from the pool (or from the mission bank if a difficulty range is
+        given) unless *fromPool* is false."""
+        start = time.perf_counter()
+        try:
+            if params['random']:
+                key = (params['players'], params['double'], params['difficulty'])
+                if params['seed'] is not None:
+                    return generateMission(key, params['seed'])
+                if not fromPool:
+                    return missionPool.generate(key)
+                result = sampleBankFile(key, params)
+                if result is not None:
+                    return result
+                if params['challenge'] is not None:
+                    low, high = missionBank.scoreRange(key, *CHALLENGES[params['challenge']])
+                    return missionBank.get(key, low, high)
+                if params['minScore'] is not None or params['maxScore'] is not None:
+                    return missionBank.get(key, params['minScore'], params['maxScore'])
+                return missionPool.get(key)
+            else: return None, loadScript(params['script'], params['players'], params['difficulty'])
+        finally:
+            self.addGenerationTime(start)
+            
+    def getSeededResponse(self, type, params, render):
+        """Return the pair (content, ETag) of a seeded random mission from the response cache. On a cache
+        miss, generate the mission and render it with *render*. *type* distinguishes different renderings
+        of the same mission."""
+        cacheKey = (type, params['seed'], params['players'], params['double'], params['difficulty'])
+        response = responseCache.get(cacheKey)
+        if response is None:
+            seed, mission = self.getMission(params)
+            start = time.perf_counter()
+            response = responseCache.put(cacheKey, render(mission))
+            self.addGenerationTime(start)
+        return response
+    
+    def sendScriptError(self, error):
+        """Send an error page for a mission script that could not be read or parsed (scripts given with
+        --scripts are only parsed when they are first requested). The page contains the message of
+        *error*, which includes the line number for ScriptErrors."""
+        self.log_error("Mission script could not be loaded: %s", error)
+        self.send_error(500, "Mission script could not be loaded", str(error))
+        
+    def sendMission(self, url, head=False):
+        """Handle /api/mission: Send one mission as JSON (see Mission.asDict). Missions with a seed can be
+        cached by clients."""
+        params = self.parseGetParams(url)
+        try:
+            if params['random'] and params['seed'] is not None:
+                content, etag = self.getSeededResponse('json', params, missionJSON)
+                self.sendContent(content, "application/json", etag, CACHE_CONTROL_SEEDED, head)
+                return
+            seed, mission = self.getMission(params)
+        except (RuntimeError, spacealert.InvalidMissionError) as e:
+            print(e)
+            self.send_error(500, "Mission could not be generated")
+            return
+        except (missionscripts.ScriptError, OSError) as e:
+            self.sendScriptError(e)
+            return
+        self.sendContent(missionJSON(mission), "application/json", head=head,
+                         headers={"X-Mission-Seed": str(seed)} if seed is not None else None)
+        
+    def sendMissionStream(self, url, head=False):
+        """Handle /api/missions?n=...: Send n missions as newline-delimited JSON, one mission per line.
+        Missions are generated while sending (bypassing the pool, which is reserved for players). If a
+        seed is given, the seeds of the missions are derived from it, so that the stream is reproducible.
+        If generation fails, the last line is an object {"error": message}."""
+        params = self.parseGetParams(url)
+        n = urllib.parse.parse_qs(url.query).get('n', [''])[-1]
+        if not n.isdigit() or not 1 <= int(n) <= API_MAX_MISSIONS:
+            self.send_error(400, "Parameter n must be a number between 1 and {}".format(API_MAX_MISSIONS))
+            return
+        
+        if params['seed'] is not None:
+            seeds = spacealert.missionSeeds(params['seed'], int(n))
+        else: seeds = (None for i in range(int(n)))
+        
+        def lines():
+            for seed in seeds:
+                try:
+                    seed, mission = self.getMission(dict(params, seed=seed), fromPool=False)
+                except (RuntimeError, spacealert.InvalidMissionError) as e:
+                    print(e)
+                    yield json.dumps({'error': "Mission could not be generated"}).encode('utf-8') + b'\n'
+                    return
+                except (missionscripts.ScriptError, OSError) as e:
+                    self.log_error("Mission script could not be loaded: %s", e)
+                    yield json.dumps({'error': str(e)}).encode('utf-8') + b'\n'
+                    return
+                yield missionJSON(mission) + b'\n'
+            
+        self.sendChunked(lines(), "application/x-ndjson", head)
+        
     def do_GET(self):
         if not self.doHelper(head=False):
             return
@@ -148,65 +773,74 @@ class RequestHandler(http.server.SimpleHTTPRequestHandler):
         # Make events
         if params['random']:
             try:
-                if params['double']:
-                    options = spacealert.Options.createDoubleActions(params['players'])
-                else: options = spacealert.Options.create(params['players'])
-                options.difficulty = params['difficulty']
-                generator = spacealert.MissionGenerator(options)
-                mission = generator.makeMission()
+                if params['seed'] is None:
+                    # Take a mission from the pool, cache it under its seed and redirect to its URL, so
+                    # that reloading or sharing the URL shows the same mission.
+                    seed, mission = self.getMission(params)
+                    start = time.perf_counter()
+                    cacheKey = ('html', seed, params['players'], params['double'], params['difficulty'])
+                    responseCache.put(cacheKey, renderPlayer(mission))
+                    self.addGenerationTime(start)
+                    self.redirectToSeed(url, seed)
+                    return
+                content, etag = self.getSeededResponse('html', params, renderPlayer)
             except (RuntimeError, spacealert.InvalidMissionError) as e:
                 print(e)
                 self.send_error(500, "Mission could not be generated")
                 return
+            self.sendContent(content, "text/html", etag, CACHE_CONTROL_SEEDED)
         else:
-            mission = loadScript(params['script'], params['players'], params['difficulty'])
-            
-        javaScript = map(getJavaScript, mission.events)
-        content = ',\n'.join(s for s in javaScript if len(s) > 0)
-            
-        self.send_response(200)
-        self.send_header("Content-type", "text/html")
-        self.end_headers()
-        self.wfile.write(htmlParts['header'])
-        self.wfile.write(b"var events = [\n");
-        self.wfile.write(content.encode('utf-8'))
-        self.wfile.write(b"\n];\n\n");
-        self.wfile.write(htmlParts['body'])
+            start = time.perf_counter()
+            try:
+                content, etag = getScriptResponse(params['script'], params['players'], params['difficulty'])
+            except (missionscripts.ScriptError, OSError) as e:
+                self.sendScriptError(e)
+                return
+            finally:
+                self.addGenerationTime(start)
+            self.sendContent(content, "text/html", etag, cacheControl="no-cache")
 
 
-def loadScript(name, players, difficulty):
-    from spacealert import Phase, Alert, IncomingData, CommunicationsDown, DataTransfer, parseTime
-    from scripts import scripts
-    
-    if name not in scripts:
+def resolveScriptName(name):
+    """Return *name* if it is the name of a script. Otherwise (e.g. for 'randommission') return the name
+    of a random mission from the CD."""
+    if name not in missionscripts.registry:
         if name != 'randommission':
             print("Unknown mission name '{}', I will use a random scripted mission.".format(name))
-        # Load random mission
-        import random
-        name = 'mission{}'.format(random.randint(1, 8))
-    
-    mission = spacealert.Mission()
-    lines = scripts[name].strip().split('\n')
-    
-    # Create phases from first line, e.g. '3:40 - 7:30 - 10:00'
-    startTime = 0
-    phaseTimes = [parseTime(time) for time in lines[0].split(' - ')]
-    for i, endTime in enumerate(phaseTimes, start=1):
-        phase = Phase(i, startTime, endTime - startTime)
-        mission.addPhase(phase)
-        startTime = endTime
-    
-    # Create events from strings like 'AL 3:30 T+4 ST Red'
-    for line in lines[1:]: # skip first line, which determines phase lengths
-        code, line = line[:2], line[3:] # remove two-letter code from line
-        if code in ['AL', 'UA']:
-            if code == 'AL' or players == 5:
-                mission.addEvent(Alert.fromString(line, difficulty))
-        else:
-            cls = {'ID': IncomingData, 'DT': DataTransfer, 'CD': CommunicationsDown}[code]
-            mission.addEvent(cls.fromString(line))
+        name = 'mission{}'.format(serverRandom.randint(1, 8))
+    return name
+
+
+def getScriptResponse(name, players, difficulty):
+    """Return the rendered player.htm for a scripted mission and its ETag. Each combination of script,
+    players and difficulty is rendered only once."""
+    name = resolveScriptName(name)
+    key = (name, players, difficulty)
+    if key not in scriptCache:
+        content = renderPlayer(loadScript(name, players, difficulty))
+        scriptCache[key] = (content, makeETag(content))
+    return scriptCache[key]
+    
+
+def sampleBankFile(key, params):
+    """Return a random pair (seed, mission) for *key* from the mission bank file that matches the
+    challenge or score range in the GET parameters *params*. Return None if there is no bank file or it
+    contains no such mission."""
+    if bankFile is None or key not in bankFile.keys:
+        return None
+    if params['challenge'] is not None:
+        low, high = bankFile.scoreRange(key, *CHALLENGES[params['challenge']])
+    else: low, high = params['minScore'], params['maxScore']
+    index = bankFile.sample(key, low, high, serverRandom)
+    if index is None:
+        return None
+    return bankFile.mission(index)
+    
+
+def loadScript(name, players, difficulty):
+    """Return a new Mission for the script *name* (compare resolveScriptName)."""
+    return missionscripts.registry.mission(resolveScriptName(name), players, difficulty)
     
-    return mission
     
 if __name__ == "__main__":
     if False:
@@ -217,6 +851,32 @@ if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description="Run the Space Alert Mission Player server.")
     parser.add_argument('--port', type=int, help="Port where the server should run, defaults to 8000.", default=8000)
+    parser.add_argument('--scripts', default=None,
+                        help="Directory containing additional mission scripts (*.txt, see missionscripts.py), which can be played via player.htm?playscript=1&script=<file name>.")
+    parser.add_argument('--mode', choices=['threaded', 'single'], default='threaded',
+                        help="'threaded' (default) handles requests in a pool of threads, 'single' handles one request at a time.")
+    parser.add_argument('--threads', type=int, default=16,
+                        help="Maximal number of requests handled at the same time in threaded mode, defaults to 16.")
+    parser.add_argument('--pool-size', type=int, dest='poolSize', default=10,
+                        help="Number of missions to pre-generate for each combination of players, double actions and difficulty, defaults to 10. Use 0 to disable pre-generation. Pool statistics are available at /pool.json.")
+    parser.add_argument('--pool-low', type=int, dest='poolLowWatermark', default=None,
+                        help="Refill the pool for a combination when fewer missions are ready, defaults to half the pool size.")
+    parser.add_argument('--access-log', choices=accesslog.MODES, dest='logMode', default='full',
+                        help="Write one JSON record per request ('full', default), only for some requests ('sampled') or none ('off').")
+    parser.add_argument('--access-log-file', dest='logFile', default=None,
+                        help="File to which the access log is appended, defaults to stderr.")
+    parser.add_argument('--access-log-sample', type=float, dest='logSampleRate', default=0.1,
+                        help="Fraction of requests logged in sampled mode, defaults to 0.1. Server errors are always logged.")
+    parser.add_argument('--bank-size', type=int, dest='bankSize', default=50,
+                        help="Number of missions kept for each combination of players, double actions and difficulty, sorted by their difficulty score, to serve requests for easier or harder missions (player.htm?challenge=easy|normal|hard or minScore=...&maxScore=...). Defaults to 50, use 0 to disable pre-generation. Statistics are available at /bank.json.")
+    parser.add_argument('--bank-low', type=int, dest='bankLowWatermark', default=None,
+                        help="Refill the mission bank for a combination when fewer unused missions are left, defaults to half the bank size.")
+    parser.add_argument('--bank-file', dest='bankPath', default=None,
+                        help="Serve random missions from this mission bank file (create it with bankfile.py). Combinations that are missing in the file are served from the pool. Consider --pool-size 0 and --bank-size 0 if the file contains all combinations.")
+    parser.add_argument('--cache-size', type=int, dest='cacheSize', default=1000,
+                        help="Number of rendered missions kept in memory, so that reloading a mission (its URL contains the seed) does not generate it again. Defaults to 1000.")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="Fork this many server processes to use several cores (POSIX only). Crashed workers are restarted. Each worker has its own mission pool and bank (so N workers pre-generate N pools), and /pool.json, /bank.json and /metrics describe the worker that answers the request; metrics carry a 'worker' label. Defaults to 0 (a single process).")
 
     args = vars(parser.parse_args())
     run(**args)
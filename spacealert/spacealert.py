@@ -16,7 +16,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
-import random, itertools, bisect
+import random, itertools, bisect, functools, multiprocessing, math, copy, array, time, collections, threading
 
 MAX_ITERATIONS = 100
 
@@ -69,7 +69,15 @@ class Options:
                      # Thus a high number of surplus times shifts the distribution of all times to lower values.
     ambushProbabilities = (0.25, 0.25) # probability of an ambush in phase 1, resp. 2
     
-    OPTIONS = [("length", int), ("doubleActions", bool), ("solo", bool), ("threatPoints", int), ("minCount", int), ("maxCount", int), ("minTpInternal", int), ("maxTpInternal", int), ("minCountInternal", int), ("maxCountInternal", int),("difficulty", str), ("pInternal", float), ("pSerious", float), ("pSeriousInternal", float), ("minTpPerPhase", int), ("maxTpPerPhase", int), ("earliestInternal", int), ("latestInternal", int), ("earliestSeriousInternal", int),("latestSeriousInternal", int), ("allowConsecutiveInternalThreats", bool), ("allowSimultaneousThreats", bool), ("maxInternalThreatsPerPhase", int), ("maxTpPerTurn", int)]
+    # Retries
+    #========
+    stageRetries = 3 # A failed stage of mission generation is retried this many times before the previous
+                     # stage is retried, too (see MissionGenerator.makeMission).
+    
+    OPTIONS = [("length", int), ("doubleActions", bool), ("solo", bool), ("threatPoints", int), ("minCount", int), ("maxCount", int), ("minTpInternal", int), ("maxTpInternal", int), ("minCountInternal", int), ("maxCountInternal", int),("difficulty", str), ("pInternal", float), ("pSerious", float), ("pSeriousInternal", float), ("minTpPerPhase", int), ("maxTpPerPhase", int), ("earliestInternal", int), ("latestInternal", int), ("earliestSeriousInternal", int),("latestSeriousInternal", int), ("allowConsecutiveInternalThreats", bool), ("allowSimultaneousThreats", bool), ("maxInternalThreatsPerPhase", int), ("maxTpPerTurn", int), ("stageRetries", int)]
+    # All options, including those which cannot be set via update (compare freeze).
+    FROZEN_OPTIONS = [option for option, oType in OPTIONS] + ['unconfirmed', 'threatLength', 'threatDistance',
+                                                              'fixedAlerts', 'surplusTimes', 'ambushProbabilities']
     
     def __init__(self, **args):
         self.update(**args)
@@ -83,6 +91,22 @@ class Options:
                         value = args[option].lower() in ['1', 'true', 'yes', 'y']
                     else: value = oType(args[option])
                 setattr(self, option, value)
+    
+    def key(self, names=None):
+        """Return a hashable tuple containing the values of the given options (default: all options in
+        OPTIONS). This is used as key for caches that depend on options."""
+        if names is None:
+            names = [option for option, oType in self.OPTIONS]
+        return tuple(getattr(self, name) for name in names)
+    
+    def freeze(self):
+        """Return a hashable tuple of pairs (name, value) of all options in FROZEN_OPTIONS (lists are
+        converted to tuples). Options with the same frozen form generate the same missions."""
+        result = []
+        for name in self.FROZEN_OPTIONS:
+            value = getattr(self, name)
+            result.append((name, tuple(value) if isinstance(value, list) else value))
+        return tuple(result)
         
     @staticmethod
     def create(playerNumber, **args):
@@ -125,6 +149,21 @@ class Options:
         options.update(**args)
         return options
 
+
+# Difficulties of random missions offered by the server and other tools
+DIFFICULTIES = ['w', 'y', 'r', 'wy', 'wr', 'yr', 'wyr']
+# Keys (players, double, difficulty) of all standard settings for random missions (compare makeOptions)
+MISSION_KEYS = [(players, double, difficulty) for players in (4, 5) for double in (False, True)
+                                              for difficulty in DIFFICULTIES]
+
+def makeOptions(players, double, difficulty):
+    """Return the options for a random mission with the given settings (compare MISSION_KEYS)."""
+    if double:
+        options = Options.createDoubleActions(players)
+    else: options = Options.create(players)
+    options.difficulty = difficulty
+    return options
+
      
 class Zone:
     """One of the three zones of the ship."""
@@ -134,10 +173,33 @@ class Zone:
         
     def __repr__(self):
         return self.name
+    
+    def __reduce__(self):
+        # Unpickle zones as the instances in ZONES, so that they can still be compared by identity.
+        return (getZone, (self.code,))
         
 ZONES = (Zone('Red', 'R'), Zone('White', 'W'), Zone('Blue', 'B'))
 
 
+_zonesByCode = {zone.code: zone for zone in ZONES}
+_zonesByName = {zone.name.lower(): zone for zone in ZONES}
+
+def getZone(code):
+    """Return the zone with the given code."""
+    try:
+        return _zonesByCode[code]
+    except KeyError:
+        raise ValueError("Unknown zone code: {}".format(code))
+    
+
+def getZoneByName(name):
+    """Return the zone with the given name (case-insensitive)."""
+    try:
+        return _zonesByName[name.lower()]
+    except KeyError:
+        raise ValueError("Unknown zone: {}".format(name))
+
+
 class ThreatType:
     """A threat type is the combination of the properties external/internal and normal/serious of a threat."""
     def __init__(self, name, code):
@@ -158,6 +220,10 @@ class ThreatType:
     @property
     def points(self):
         return 2 if self.serious else 1
+    
+    def __reduce__(self):
+        # Unpickle threat types as the instances in THREAT_TYPES, so that they can still be compared by identity.
+        return (getThreatType, (self.code,))
         
         
 T_EXTERNAL = ThreatType('Threat', 'T')
@@ -167,8 +233,21 @@ T_SERIOUS_INTERNAL = ThreatType('Serious Internal Threat', 'SIT')
 THREAT_TYPES = [T_EXTERNAL, T_INTERNAL, T_SERIOUS_EXTERNAL, T_SERIOUS_INTERNAL]
 
 
+_threatTypesByCode = {threatType.code: threatType for threatType in THREAT_TYPES}
+
+def getThreatType(code):
+    """Return the threat type with the given code."""
+    try:
+        return _threatTypesByCode[code]
+    except KeyError:
+        raise ValueError("Unknown threat type code: {}".format(code))
+
+
 class Event:
-    """Abstract superclass for all events (threats, incoming data, etc.)."""
+    """Abstract superclass for all events (threats, incoming data, etc.). Events use __slots__ to keep
+    large numbers of missions small; *phase* is set when the event is added to a mission."""
+    __slots__ = ('start', 'phase')
+    
     def __init__(self, start):
         self.start = start
         
@@ -211,6 +290,11 @@ class Event:
         # subclasses must either define 'duration' or provide a different implementation of 'end'
         return self.start + self.duration
     
+    def asDict(self):
+        """Return a dict describing this event which can be serialized to JSON. 'type' is the name of
+        the corresponding class in player.js."""
+        return {'type': type(self).__name__, 'start': self.start}
+    
     @classmethod
     def fromString(cls, string):
         return cls(parseTime(string))
@@ -218,6 +302,7 @@ class Event:
         
 class Alert(Event):
     """The most important event: An attacking enemy."""
+    __slots__ = ('turn', 'type', 'zone', 'difficulty', 'ambush')
     duration = 15
     def __init__(self, start=None, turn=None, type=None, zone=None, difficulty="w", ambush=False):
         super().__init__(start)
@@ -262,6 +347,15 @@ class Alert(Event):
     def threatPoints(self):
         return 2 if self.serious else 1
     
+    def asDict(self):
+        return {'type': 'Alert',
+                'start': self.start,
+                'turn': self.turn,
+                'threat': self.type.code,
+                'zone': self.zone.name.lower() if self.zone is not None else None,
+                'difficulty': {'w': 'white', 'y': 'yellow', 'r': 'red'}[self.difficulty],
+                'ambush': self.ambush}
+    
     @staticmethod
     def fromString(string, difficulty="w"):
         """Return an alert from a string like '0:10 T+2 T White."""
@@ -269,28 +363,17 @@ class Alert(Event):
         time = parseTime(time)
         assert turn.startswith('T+')
         turn = int(turn[2:])
-        if threatType == 'T':
-            threatType = T_EXTERNAL
-        elif threatType == 'ST':
-            threatType = T_SERIOUS_EXTERNAL
-        elif threatType == 'IT':
-            threatType = T_INTERNAL
-        elif threatType == 'SIT':
-            threatType = T_SERIOUS_INTERNAL
-        else: assert False
-        if threatType in (T_EXTERNAL, T_SERIOUS_EXTERNAL):
-            zone = zone.strip()
-            for z in ZONES:
-                if z.name.lower() == zone.lower():
-                    zone = z
-                    break
-            else: assert False
+        threatType = getThreatType(threatType)
+        if not threatType.internal:
+            zone = getZoneByName(zone.strip())
         else: zone = None
         return Alert(time, turn, threatType, zone, difficulty=difficulty)
         
     
 class PhaseEvent(Event):
     """PhaseEvents announce the end of a certain phase, e.g. "Phase 2 ends in 20 seconds.". *remaining* is the remaining time in seconds."""
+    __slots__ = ('remaining', 'lastPhase', 'duration')
+    
     def __init__(self, start, phase, remaining, lastPhase=None):
         super().__init__(start)
         self.phase = phase
@@ -309,6 +392,14 @@ class PhaseEvent(Event):
     def getCode(self):
         return "{}PE{}".format(self.start+self.remaining, self.phase.number);
     
+    def asDict(self):
+        # lastPhase is computed like in server.getJavaScript
+        return {'type': 'PhaseEvent',
+                'start': self.start,
+                'phase': self.phase.number,
+                'remaining': self.remaining,
+                'lastPhase': self.phase.number == 3}
+    
     @property
     def message(self):        
         return "{} - Phase {} ends in {} seconds" \
@@ -316,6 +407,7 @@ class PhaseEvent(Event):
         
         
 class IncomingData(Event):
+    __slots__ = ()
     duration = 5
     def __repr__(self):
         return "{}ID".format(self.timeCode)
@@ -326,6 +418,7 @@ class IncomingData(Event):
         
         
 class DataTransfer(Event):
+    __slots__ = ()
     duration = 13
     def __repr__(self):
         return "{}DT".format(self.timeCode)
@@ -336,12 +429,17 @@ class DataTransfer(Event):
         
         
 class CommunicationsDown(Event):
+    __slots__ = ('duration',)
+    
     def __init__(self, start, duration):
         super().__init__(start)
         self.duration = duration
         
     def __repr__(self):
         return "{}CS{}".format(self.timeCode, self.duration)
+    
+    def asDict(self):
+        return {'type': 'CommunicationsDown', 'start': self.start, 'duration': self.duration}
         
     @property
     def message(self):
@@ -357,6 +455,8 @@ class CommunicationsDown(Event):
 
 class Phase:
     """One of the three phases of the mission. *number* should be in [1,2,3]."""
+    __slots__ = ('number', 'start', 'length')
+    
     def __init__(self, number, start, length):
         self.number = number
         self.start = start
@@ -378,6 +478,9 @@ class Phase:
     def __int__(self):
         return self.number-1
     
+    def asDict(self):
+        return {'number': self.number, 'start': self.start, 'length': self.length}
+    
     @staticmethod
     def fromString(string):
         number, start, end = string.split(' - ')
@@ -392,10 +495,15 @@ class InvalidMissionError(Exception):
 
 
 class Mission:
-    """A missions of SpaceAlert. This is mainly an ordered list of events, grouped into three phases."""
+    """A missions of SpaceAlert. This is mainly an ordered list of events, grouped into three phases.
+    Events are kept sorted by their start time and must only be added via addEvent(s)."""
     def __init__(self):
         self.phases = []
         self.events = []
+        self._phaseStarts = [] # start times of phases, for bisect
+        self._starts = []      # start times of events (in the same order as self.events), for bisect
+        self._maxDuration = 0  # maximal duration of all events, bounds the search in collides and eventAt
+        self._occupied = 0     # bitmap: bit i is set if an event is running at second i
         
     @property
     def length(self):
@@ -403,20 +511,26 @@ class Mission:
             return 0
         else: return self.phases[-1].end
      
-    def addPhase(self, phase):
+    def addPhase(self, phase, addEvents=True):
+        """Add a phase at the end of the mission. Unless *addEvents* is false, also add the events which
+        announce the end of the phase."""
         start = 0 if len(self.phases) == 0 else self.phases[-1].end
         assert phase.start == start
         self.phases.append(phase)
-        self.addEvents(phase.getEvents())
+        self._phaseStarts.append(phase.start)
+        if addEvents:
+            self.addEvents(phase.getEvents())
         
     def addEvent(self, event):
-        i = 0
-        while i < len(self.events) and self.events[i].time < event.time:
-            i += 1
-        for phase in self.phases:
-            if phase.start <= event.time < phase.end:
-                event.phase = phase
+        # Insert before all events with the same start time
+        i = bisect.bisect_left(self._starts, event.time)
+        phase = self.phaseAt(event.time)
+        if phase is not None:
+            event.phase = phase
         self.events.insert(i, event)
+        self._starts.insert(i, event.time)
+        self._maxDuration = max(self._maxDuration, event.duration)
+        self._occupied |= _bits(event.start, event.duration)
     
     def addEvents(self, events):
         for event in events:
@@ -426,8 +540,52 @@ class Mission:
     def length(self):
         return self.events[-1].time if len(self.events) > 0 else 0
         
+    def phaseAt(self, time):
+        """Return the phase containing *time* or None if *time* is outside of the mission."""
+        i = bisect.bisect_right(self._phaseStarts, time) - 1
+        if i >= 0 and time < self.phases[i].end:
+            return self.phases[i]
+        else: return None
+        
+    def snapshot(self):
+        """Return an object which can be passed to restore to remove all events that are added after this
+        call. Phases must not be added in between."""
+        return (list(self.events), list(self._starts), self._maxDuration, self._occupied)
+    
+    def restore(self, snapshot):
+        """Restore the state of a previous call of snapshot."""
+        events, starts, self._maxDuration, self._occupied = snapshot
+        self.events = list(events)
+        self._starts = list(starts)
+        
+    def isFree(self, start, duration):
+        """Return whether no event is running between *start* and *start+duration*."""
+        return self._occupied & _bits(start, duration) == 0
+        
+    def eventsBetween(self, start, end):
+        """Return a list of all events starting at or after *start* and before *end*."""
+        return self.events[bisect.bisect_left(self._starts, start):bisect.bisect_left(self._starts, end)]
+    
+    def eventAt(self, time):
+        """Return the event which is running at *time* (i.e. event.start <= time < event.end). If there are
+        several such events, return the one which started last. Return None if no event is running."""
+        for event in reversed(self.eventsBetween(time - self._maxDuration, time+1)):
+            if event.contains(time):
+                return event
+        return None
+    
+    def nextEvent(self, time):
+        """Return the first event starting at or after *time* or None if there is no such event."""
+        i = bisect.bisect_left(self._starts, time)
+        return self.events[i] if i < len(self.events) else None
+        
     def log(self, separator="\n"):
         return separator.join(event.message for event in self.events)
+    
+    def asDict(self):
+        """Return a dict with the phases and events of this mission which can be serialized to JSON."""
+        return {'phases': [phase.asDict() for phase in self.phases],
+                'events': [event.asDict() for event in self.events]}
         
     def difficulty(self):
         """Experimental: Try to compute a difficulty value for this mission."""
@@ -451,11 +609,171 @@ class Mission:
         return event.start < 10 \
                    or event.start in range(self.phases[1].start, self.phases[1].start+5) \
                    or event.start in range(self.phases[1].start, self.phases[1].start+5) \
-                   or any(e.intersects(event) for e in self.events)
+                   or any(e.intersects(event)
+                          for e in self.eventsBetween(event.start - self._maxDuration, event.end))
        
 
+def _bits(start, duration):
+    """Return a bitmap in which the bits of the seconds from *start* to *start+duration* are set (compare
+    Mission._occupied). Seconds before 0 are ignored, e.g. if options with a short length push events to
+    negative times."""
+    if start < 0:
+        duration += start
+        start = 0
+    if duration <= 0:
+        return 0
+    return ((1 << duration) - 1) << start
+    
+    
+class PackedMission:
+    """Compact representation of a mission, e.g. to keep large numbers of missions in memory. Instead of
+    event objects it stores one fixed-width column per attribute (struct of arrays), all in a single
+    bytes object *data*. Use fromMission and toMission to convert from and to Mission without loss.
+    
+    *data* starts with the number of phases and events (unsigned shorts), followed by the columns:
+    
+        - phaseEnds (unsigned short): end of each phase in seconds
+        - starts (signed short): in seconds, may be negative for events before the mission start
+        - durations (unsigned short): in seconds
+        - kinds (byte): index in KINDS, for alerts KIND_ALERT + index of the threat type in THREAT_TYPES
+        - turns (byte): the turn of alerts, the remaining seconds of phase events
+        - zones (byte): 0 for events without zone, otherwise 1 + index in ZONES
+        - difficulties (byte): index in DIFFICULTY_CODES
+        - flags (byte): FLAG_AMBUSH for ambushes, FLAG_LAST_PHASE for phase events with lastPhase set
+    
+    The columns are available as memoryviews via the attributes of the same name.
+    """
+    __slots__ = ('data',)
+    
+    KINDS = (PhaseEvent, IncomingData, DataTransfer, CommunicationsDown)
+    KIND_ALERT = len(KINDS)
+    DIFFICULTY_CODES = 'wyr'
+    FLAG_AMBUSH = 1
+    FLAG_LAST_PHASE = 2
+    # Names and types of the event columns in the order they are stored.
+    COLUMNS = (('starts', 'h'), ('durations', 'H'), ('kinds', 'B'), ('turns', 'B'), ('zones', 'B'),
+               ('difficulties', 'B'), ('flags', 'B'))
+    
+    def __init__(self, data):
+        self.data = data
+    
+    def __len__(self):
+        return self._header()[1]
+    
+    def __reduce__(self):
+        return (PackedMission, (self.data,))
+    
+    def __getattr__(self, name):
+        phaseCount, eventCount = self._header()
+        offset = 4
+        if name == 'phaseEnds':
+            return memoryview(self.data)[offset:offset+2*phaseCount].cast('H')
+        offset += 2*phaseCount
+        for column, format in self.COLUMNS:
+            size = eventCount * array.array(format).itemsize
+            if column == name:
+                return memoryview(self.data)[offset:offset+size].cast(format)
+            offset += size
+        raise AttributeError("PackedMission has no attribute '{}'.".format(name))
+    
+    def _header(self):
+        return memoryview(self.data)[:4].cast('H')
+    
+    @property
+    def length(self):
+        phaseEnds = self.phaseEnds
+        return phaseEnds[-1] if len(phaseEnds) > 0 else 0
+    
+    @staticmethod
+    def fromMission(mission):
+        """Create a PackedMission from a Mission."""
+        columns = {name: array.array(format) for name, format in PackedMission.COLUMNS}
+        for event in mission.events:
+            turn = zone = difficulty = flags = 0
+            if isinstance(event, Alert):
+                kind = PackedMission.KIND_ALERT + THREAT_TYPES.index(event.type)
+                turn = event.turn
+                if event.zone is not None:
+                    zone = 1 + ZONES.index(event.zone)
+                difficulty = PackedMission.DIFFICULTY_CODES.index(event.difficulty)
+                if event.ambush:
+                    flags |= PackedMission.FLAG_AMBUSH
+            else:
+                kind = PackedMission.KINDS.index(type(event))
+                if isinstance(event, PhaseEvent):
+                    turn = event.remaining
+                    if event.lastPhase:
+                        flags |= PackedMission.FLAG_LAST_PHASE
+            columns['starts'].append(event.start)
+            columns['durations'].append(event.duration)
+            columns['kinds'].append(kind)
+            columns['turns'].append(turn)
+            columns['zones'].append(zone)
+            columns['difficulties'].append(difficulty)
+            columns['flags'].append(flags)
+        header = array.array('H', [len(mission.phases), len(mission.events)])
+        header.extend(phase.end for phase in mission.phases)
+        return PackedMission(header.tobytes()
+                             + b''.join(columns[name].tobytes() for name, format in PackedMission.COLUMNS))
+    
+    def toMission(self):
+        """Return a Mission containing the phases and events stored in this object."""
+        mission = Mission()
+        start = 0
+        for i, end in enumerate(self.phaseEnds, start=1):
+            mission.addPhase(Phase(i, start, end - start), addEvents=False)
+            start = end
+        # Mission.addEvent inserts an event in front of all events with the same start. Adding the
+        # events in reverse order thus restores the original order.
+        mission.addEvents(reversed(self.events(mission)))
+        return mission
+    
+    def events(self, mission):
+        """Return a list of event objects for all events. Phase events refer to the phases of *mission*."""
+        result = []
+        for start, duration, kind, turn, zone, difficulty, flags in zip(
+                *(getattr(self, name) for name, format in self.COLUMNS)):
+            if kind >= self.KIND_ALERT:
+                result.append(Alert(start, turn, THREAT_TYPES[kind - self.KIND_ALERT],
+                                    ZONES[zone-1] if zone > 0 else None,
+                                    self.DIFFICULTY_CODES[difficulty],
+                                    bool(flags & self.FLAG_AMBUSH)))
+            else:
+                cls = self.KINDS[kind]
+                if cls is PhaseEvent:
+                    result.append(PhaseEvent(start, mission.phaseAt(start), turn,
+                                             bool(flags & self.FLAG_LAST_PHASE)))
+                elif cls is CommunicationsDown:
+                    result.append(CommunicationsDown(start, duration))
+                else: result.append(cls(start))
+        return result
+    
+    def difficulty(self):
+        """Return the same value as Mission.difficulty without creating event objects."""
+        result = 0
+        tpOnZone = [0] * (len(ZONES)+1)
+        for kind, zone, flags in zip(self.kinds, self.zones, self.flags):
+            if kind >= self.KIND_ALERT:
+                threatType = THREAT_TYPES[kind - self.KIND_ALERT]
+                if threatType.internal:
+                    result += 1.5 * threatType.points
+                else:
+                    result += threatType.points
+                    tpOnZone[zone] += threatType.points
+                if flags & self.FLAG_AMBUSH:
+                    result += threatType.points
+        result += max(tpOnZone[1:])
+        return result
+    
+
 class MissionGenerator:
-    """A MissionGenerator is Initialized with a set of options (either as object or as keyword-arguments) and can be used to generate one or more missions."""
+    """A MissionGenerator is Initialized with a set of options (either as object or as keyword-arguments) and can be used to generate one or more missions.
+    
+    Generation is reentrant: The generator itself holds no state of the mission being generated. Each
+    call of makeMission creates a Mission and uses the random number generator passed to it (a
+    random.Random), and passes both on to the stages. Thus a generator can be shared by several threads,
+    and each mission is determined by the seed of its random number generator.
+    """
     
     # Number of (incoming data, data transfer)
     DATA_DISTRIBUTION = {
@@ -476,32 +794,152 @@ class MissionGenerator:
     # Maximum number of communications down in the three phases
     MAX_COMMUNICATIONS_DOWN = (15, 25, 40)
     
-    def __init__(self, options=None, **args):
-        self.mission = None
+    # Methods which perform one stage of mission generation, in the order in which they are called.
+    # Sub-stages follow the stage that calls them (e.g. makeThreats calls chooseThreatTuple).
+    STAGES = ('makePhases', 'choosePhaseLengths', 'makeThreats', 'chooseThreatTuple', 'assignThreatsToTurns',
+              'chooseThreatTimes', 'chooseThreatZones', 'chooseDifficulties', 'makeOtherEvents',
+              'distributeEvents')
+    
+    def __init__(self, options=None, observer=None, **args):
         if options is not None:
             self.options = options
         else: self.options = Options(**args)
+        self.observer = observer
+        if observer is not None:
+            # Shadow the stage methods by instrumented versions. Without observer the methods are called
+            # directly, so observing costs nothing unless it is used.
+            self._attempts = threading.local() # attempts are counted per makeMission call and thread
+            for stage in ('makeMission',) + self.STAGES:
+                setattr(self, stage, self._observed(stage, getattr(self, stage)))
+        
+    def _observed(self, stage, method):
+        """Return a wrapper of the bound *method* which reports each call to the observer."""
+        observer = self.observer
+        local = self._attempts
+        
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            attempts = getattr(local, 'counter', None)
+            if attempts is None:
+                attempts = local.counter = collections.Counter()
+            if stage == 'makeMission':
+                # Count attempts of the other stages per mission
+                makeMissionAttempts = attempts['makeMission']
+                attempts.clear()
+                attempts['makeMission'] = makeMissionAttempts
+            attempts[stage] += 1
+            attempt = attempts[stage]
+            start = time.perf_counter()
+            observer.stageStarted(self, stage, attempt, start)
+            try:
+                result = method(*args, **kwargs)
+            except Exception as e:
+                observer.stageFinished(self, stage, attempt, start, time.perf_counter(), e)
+                raise
+            observer.stageFinished(self, stage, attempt, start, time.perf_counter(), None)
+            return result
+        return wrapper
         
     def __getattr__(self, attr):
         if hasattr(self.options, attr):
             return getattr(self.options, attr)
         else: raise AttributeError("MissionGenerator has no attribute '{}'.".format(attr))
    
-    def makeMission(self):
-        self.mission = Mission()
-        self.makePhases()
-        self.makeThreats()
-        if not self.solo:
-            self.makeOtherEvents()
-        return self.mission
-        
-    def makePhases(self):
-        lengths = self.choosePhaseLengths()
-        self.mission.addPhase(Phase(1, 0, lengths[0]))
-        self.mission.addPhase(Phase(2, lengths[0], lengths[1]))
-        self.mission.addPhase(Phase(3, lengths[0]+lengths[1], lengths[2]))
-        
-    def choosePhaseLengths(self):
+    def makeMission(self, rng=None, maxIterations=None):
+        """Generate a mission using the random number generator *rng* (a random.Random; by default a new
+        one seeded from the operating system). Generation is transactional per stage: If a stage fails, its
+        changes are rolled back and only this stage is retried. After *stageRetries* failed attempts the
+        previous stage is rolled back and retried, too (e.g. if special events cannot be placed, new
+        threats are chosen; if threats cannot be placed, new phases are chosen). Choosing new phases starts
+        a new iteration. Raise an InvalidMissionError only if *maxIterations* iterations fail. By default
+        the limit is adapted to the failure rate observed for the options of this generator (see
+        IterationStatistics).
+        """
+        if rng is None:
+            rng = random.Random()
+        statistics = getIterationStatistics(self.options)
+        if maxIterations is None:
+            maxIterations = statistics.limit()
+        error = InvalidMissionError("No iterations made, maxIterations must be positive (is {})"
+                                    .format(maxIterations))
+        for iteration in range(1, maxIterations+1):
+            mission = Mission()
+            self.makePhases(mission, rng)
+            phasesOnly = mission.snapshot()
+            try:
+                error = self._noAttemptsError()
+                for i in range(self.stageRetries):
+                    self.makeThreats(mission, rng)
+                    if self.solo:
+                        break
+                    try:
+                        self._retry(mission, self.makeOtherEvents, mission, rng)
+                        break
+                    except InvalidMissionError as e:
+                        error = e
+                        mission.restore(phasesOnly) # choose new threats
+                else: raise error # choose new phases
+            except InvalidMissionError as e:
+                error = e
+                continue
+            statistics.record(iteration, True)
+            return mission
+        statistics.record(maxIterations, False)
+        raise error
+    
+    def _retry(self, mission, function, *args, rollback=None):
+        """Call *function* with *args* and return its result. If it raises an InvalidMissionError, remove
+        the events it has added to *mission*, call *rollback* (if given) and try again. Raise the last
+        error after *stageRetries* failed attempts."""
+        snapshot = mission.snapshot()
+        error = self._noAttemptsError()
+        for i in range(self.stageRetries):
+            try:
+                return function(*args)
+            except InvalidMissionError as e:
+                error = e
+                mission.restore(snapshot)
+                if rollback is not None:
+                    rollback()
+        raise error
+    
+    def _noAttemptsError(self):
+        """Return the error raised by a stage that was not even tried once because stageRetries is not
+        positive."""
+        return InvalidMissionError("No attempts made, stageRetries must be positive (is {})"
+                                   .format(self.stageRetries))
+    
+    def makeMissions(self, number, workers=None, seed=None):
+        """Generate *number* missions in a pool of *workers* processes (default: one per CPU) and return
+        them as a list. See iterMissions."""
+        return list(self.iterMissions(number, workers, seed))
+    
+    def iterMissions(self, number, workers=None, seed=None):
+        """Generate *number* missions in a pool of *workers* processes (default: one per CPU) and yield
+        them in order. Each mission is generated from its own seed, which is derived from *seed*. Thus
+        the same *seed* will always produce the same missions (given the same options), independently
+        of the number of workers. Failed attempts are retried within the worker (compare
+        makeSeededMission).
+        """
+        seeds = missionSeeds(seed, number)
+        function = functools.partial(makeSeededMission, self.options)
+        if workers == 1:
+            yield from map(function, seeds)
+            return
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        # Missions are generated very fast, so send them in chunks to reduce communication overhead.
+        chunksize = max(1, min(100, number // (4*workers)))
+        with multiprocessing.Pool(workers) as pool:
+            yield from pool.imap(function, seeds, chunksize)
+        
+    def makePhases(self, mission, rng):
+        lengths = self.choosePhaseLengths(rng)
+        mission.addPhase(Phase(1, 0, lengths[0]))
+        mission.addPhase(Phase(2, lengths[0], lengths[1]))
+        mission.addPhase(Phase(3, lengths[0]+lengths[1], lengths[2]))
+        
+    def choosePhaseLengths(self, rng):
         iterations = 0
         # For some reasons the relative lengths of the standard missions are different with double actions.
         if not self.doubleActions:
@@ -518,142 +956,65 @@ class MissionGenerator:
             mean = relativeLengths[i] * self.length / 5
             min = int(mean * deviations[i][0])
             max = int(mean * deviations[i][1])
-            result[i] = 5 * binomial(min, max, m=mean)
+            result[i] = 5 * binomial(min, max, m=mean, rng=rng)
             
         return result
         
-    def makeThreats(self):
-        tt = self.chooseThreatTuple()
-        alerts = self.assignThreatsToTurns(tt)
-        if self.mission is not None: # may be None when testing threat-related functions without generating missions and phases
+    def makeThreats(self, mission, rng):
+        """Create alerts and add them to *mission*. If no times can be found for the alerts, retry with
+        new alerts (compare makeMission)."""
+        error = self._noAttemptsError()
+        for i in range(self.stageRetries):
+            tt = self.chooseThreatTuple(rng)
+            alerts = self.assignThreatsToTurns(tt, rng)
             for alert in alerts:
-                alert.phase = self.mission.phases[0] if alert.turn <= 4 else self.mission.phases[1]
-        self.chooseThreatTimes(alerts, self.mission.phases)
-        self.chooseThreatZones(alerts)
-        self.chooseDifficulties(alerts)
-        self.mission.addEvents(alerts)
-        
-    def chooseThreatTuple(self):
-        # Initialize with zero threats and check whether all parameters are valid
-        tt = ThreatTuple(self.options)
+                alert.phase = mission.phases[0] if alert.turn <= 4 else mission.phases[1]
+            def resetAmbushes():
+                for alert in alerts:
+                    alert.ambush = False
+            try:
+                self._retry(mission, self.chooseThreatTimes, alerts, mission.phases, rng, rollback=resetAmbushes)
+            except InvalidMissionError as e:
+                error = e
+                continue
+            self.chooseThreatZones(alerts, rng)
+            self.chooseDifficulties(alerts)
+            mission.addEvents(alerts)
+            return
+        raise error
         
-        # First split the threat points into external / internal
-        if not (tt.threatPoints % 2 == 0 and tt.threatPoints // 2 == tt.maxCount):
-            tt.tpInternal = binomial(tt.minTpInternal, tt.maxTpInternal, self.pInternal)
-        else:
-            # In this special case we must only use serious threats. The line above could generate an odd
-            # number for tpInternal making it impossible to satisfy the maxCount constraint
-            # Thus we restrict the binomial distribution to even numbers.
-            tt.tpInternal = 2*binomial(tt.minTpInternal//2, tt.maxTpInternal//2, self.pInternal)
-        tt.tpExternal = tt.threatPoints - tt.tpInternal
-        
-        # Note: At this point it is guaranteed that the following calls to binomial cannot fail and will
-        # always return valid solutions.
-        
-        # First check whether the various 'internal' constraints enforce at least some normal or serious
-        # internal threats.
-        if tt.tpInternal > tt.maxCountInternal:
-            tt.add(T_SERIOUS_INTERNAL, tt.tpInternal - tt.maxCountInternal)
-        if tt.tpInternal < 2 * tt.minCountInternal:
-            tt.add(T_INTERNAL, 2 * tt.minCountInternal - tt.tpInternal)
-            
-        # If tpExtern is odd, we must have a normal threat. Analogous for tpInternal.
-        if tt.tpExternal % 2 == 1:
-            tt.add(T_EXTERNAL)
-        if tt.tpInternal % 2 == 1:
-            tt.add(T_INTERNAL)
-        
-        # Now choose number of serious (external and internal) threats.
-        serious = binomial(max(0, tt.threatPoints-tt.maxCount),
-                           min(tt.threatPoints // 2, tt.threatPoints-tt.minCount),
-                           self.pSerious)
-        
-        # Split serious threat into external / internal
-        seriousInternal = binomial(max(0, serious - tt.tpExternal//2),
-                                   min(tt.tpInternal//2, serious),
-                                   self.pSeriousInternal)
-        tt.add(T_SERIOUS_INTERNAL, seriousInternal)
-        tt.add(T_SERIOUS_EXTERNAL, serious - seriousInternal)
-        
-        # And add remaining threats as normal threats
-        tt.add(T_EXTERNAL, tt.tpExternal)
-        tt.add(T_INTERNAL, tt.tpInternal)
-        #tt.check()
-        return tt
-        
-    def assignThreatsToTurns(self, threatTuple):
-        alerts = [Alert(type=tt) for tt in THREAT_TYPES for i in range(threatTuple[tt])]
-        
-        def keyFunction(alert):
-            if alert.type == T_SERIOUS_INTERNAL:
-                return 1
-            elif alert.type == T_INTERNAL:
-                return 2
-            else: return 3
-        alerts.sort(key=keyFunction)
-            
-        def tryAssign(alert):
-            if alert.type == T_SERIOUS_INTERNAL:
-                possibleRange = range(self.earliestSeriousInternal, self.latestSeriousInternal+1)
-            elif alert.type == T_INTERNAL:
-                possibleRange = range(self.earliestInternal, self.latestInternal+1)
-            else: possibleRange = range(1, 9)
-            for turn in (internalTurns if alert.internal else externalTurns):
-                if turn in possibleRange:
-                    alert.turn = turn
-                    if not alert.internal:
-                        externalTurns.remove(turn)
-                        if not self.allowSimultaneousThreats and turn in internalTurns:
-                            internalTurns.remove(turn)
-                    if alert.internal:
-                        internalTurns.remove(turn)
-                        if not self.allowConsecutiveInternalThreats:
-                            if turn-1 in internalTurns:
-                                internalTurns.remove(turn-1)
-                            if turn+1 in internalTurns:
-                                internalTurns.remove(turn+1)
-                        if not self.allowSimultaneousThreats and turn in externalTurns:
-                            externalTurns.remove(turn)
-                    return True
-            return False
-                    
-        iterations = 0
-        while True:
-            externalTurns = list(range(1, 9))
-            internalTurns = list(range(1, 9))
-            random.shuffle(externalTurns)
-            random.shuffle(internalTurns)
-            success = all(tryAssign(alert) for alert in alerts)
-            
-            if (success
-                and self.minTpPerPhase <= sum(a.type.points for a in alerts if a.turn <= 4) <= self.maxTpPerPhase 
-                and self.minTpPerPhase <= sum(a.type.points for a in alerts if a.turn > 4) <= self.maxTpPerPhase
-                and sum(1 for a in alerts if a.internal and a.turn <= 4) <= self.maxInternalThreatsPerPhase
-                and sum(1 for a in alerts if a.internal and a.turn > 4) <= self.maxInternalThreatsPerPhase
-                and (not self.allowSimultaneousThreats or
-                            all(sum(a.type.points for a in alerts if a.turn == t)
-                                <= self.maxTpPerTurn for t in range(1,9)))):
-                    alerts.sort(key=lambda a: a.turn)
-                    return alerts
-            else:
-                iterations += 1
-                if iterations >= MAX_ITERATIONS:
-                    print("Threats:", threatTuple)
-                    raise InvalidMissionError("Cannot assign threats to turns")
+    def chooseThreatTuple(self, rng):
+        """Choose the number of threats of each type. Return a ThreatTuple."""
+        return self.threatTupleTable().sample(rng)
+    
+    def threatTupleTable(self):
+        """Return the ThreatTupleTable containing the exact distribution of threat tuples for the options
+        of this generator."""
+        return getThreatTupleTable(self.options)
+        
+    def assignThreatsToTurns(self, threatTuple, rng):
+        """Create alerts for the threats in *threatTuple* and assign them to turns. Return the alerts
+        sorted by turn."""
+        return self.turnAssignmentTable(threatTuple).sample(rng)
     
-    def chooseThreatTimes(self, alerts, phases):
+    def turnAssignmentTable(self, threatTuple):
+        """Return the TurnAssignmentTable containing the exact distribution of turn assignments for
+        *threatTuple* and the options of this generator."""
+        return getTurnAssignmentTable(self.options, threatTuple)
+    
+    def chooseThreatTimes(self, alerts, phases, rng):
         for phase in phases[:2]:
             phaseAlerts = [a for a in alerts if a.phase == phase]
             if len(phaseAlerts) == 0:
                 continue
-            ambush = len(phaseAlerts) >= 3 and random.random() < self.ambushProbabilities[phase.number-1]
+            ambush = len(phaseAlerts) >= 3 and rng.random() < self.ambushProbabilities[phase.number-1]
             timeCount = len(phaseAlerts) - int(ambush) + self.surplusTimes - self.fixedAlerts[phase.number-1]
             earliestPossible = phase.start + 10 
             latestPossible = phase.end - 60 - self.threatLength
             if earliestPossible >= latestPossible:
                 raise InvalidMissionError("Cannot place threats in phase {} (time: {}-{})".format(phase.number, phase.start, phase.end))
             times = [earliestPossible] * self.fixedAlerts[phase.number-1]
-            times.extend(round5(earliestPossible + random.random() * (latestPossible-earliestPossible)) for i in range(timeCount))
+            times.extend(round5(earliestPossible + rng.random() * (latestPossible-earliestPossible)) for i in range(timeCount))
             times.sort()
             del times[len(phaseAlerts) - int(ambush):] # remove surplus times
             
@@ -673,16 +1034,16 @@ class MissionGenerator:
             shiftTimes(times, self.threatDistance, phase.end-60-self.threatLength) # don't collide with "Phase ends in one minute"
             if ambush:
                 # choose time of ambush
-                times.append(phase.end-50 + draw({0: 2, 5: 2, 10: 1}))
+                times.append(phase.end-50 + draw({0: 2, 5: 2, 10: 1}, rng))
                 phaseAlerts[-1].ambush = True
             for alert, time in zip(phaseAlerts, times):
                 alert.start = time
                 
-    def chooseThreatZones(self, alerts):
+    def chooseThreatZones(self, alerts, rng):
         lastZone = None
         for alert in alerts:
             if not alert.internal:
-                alert.zone = random.choice([z for z in ZONES if z != lastZone])
+                alert.zone = rng.choice([z for z in ZONES if z != lastZone])
                 lastZone = alert.zone
 
     def chooseDifficulties(self, alerts):
@@ -703,17 +1064,17 @@ class MissionGenerator:
             alert.difficulty = c
             sums[c] += alert.threatPoints
             
-    def makeOtherEvents(self):         
-        """Create all events which are neither phase events nor alerts."""
-        p1, p2, p3 = self.mission.phases
+    def makeOtherEvents(self, mission, rng):
+        """Create all events which are neither phase events nor alerts and add them to *mission*."""
+        p1, p2, p3 = mission.phases
         
         # Distribute Communications Down (cd)
         # First find total number of seconds. Then distribute it to phases. Then check whether to split the seconds in one phase to more than one event
         events = {p1: [], p2: [], p3: []}
-        cdTotal = draw(self.COMM_DOWN_DISTRIBUTION) - 20 # 20 seconds in third phase are certain
+        cdTotal = draw(self.COMM_DOWN_DISTRIBUTION, rng) - 20 # 20 seconds in third phase are certain
         cdDurations = {p1: 0, p2: 0, p3: 20}
         while cdTotal > 0:
-            phase = draw({p1: 1, p2: 2, p3: 3})
+            phase = draw({p1: 1, p2: 2, p3: 3}, rng)
             if cdDurations[phase] <= self.MAX_COMMUNICATIONS_DOWN[int(phase)] - 5:
                 cdDurations[phase] += 5
                 cdTotal -= 5
@@ -722,26 +1083,26 @@ class MissionGenerator:
         for phase in p1, p2, p3:
             d = cdDurations[phase]
             if d > 0:
-                if d in splitProbability and random.random() < splitProbability[d]:
+                if d in splitProbability and rng.random() < splitProbability[d]:
                     d2 = 10 if d <= 30 else 20
                     events[phase].append(CommunicationsDown(None,d2))
                     d -= d2
                 events[phase].append(CommunicationsDown(None,d))
-        self.distributeEvents(events)
+        self._retry(mission, self.distributeEvents, mission, events, rng)
         
-        totalId, totalDt = draw(self.DATA_DISTRIBUTION)
+        totalId, totalDt = draw(self.DATA_DISTRIBUTION, rng)
         events = {p1: [], p2: [], p3: []}
-        if random.random() < 0.85:
+        if rng.random() < 0.85:
             events[p3].append(DataTransfer(None))
             totalDt -= 1
-        if len(events[p3]) == 0 or random.random() < 0.15:
+        if len(events[p3]) == 0 or rng.random() < 0.15:
             events[p3].append(IncomingData(None))
             totalId -= 1
             
         events[p2].append(DataTransfer(None))
         totalDt -= 1
         
-        if random.random() < 0.5 and totalId >= 1 and totalDt >= 1 and totalId+totalDt > 2: # leave one for phase 2
+        if rng.random() < 0.5 and totalId >= 1 and totalDt >= 1 and totalId+totalDt > 2: # leave one for phase 2
             events[p1].append(IncomingData(None))
             events[p1].append(DataTransfer(None))
             totalId -= 1
@@ -751,7 +1112,7 @@ class MissionGenerator:
             nextEventPhase = p1
         
         while totalId+totalDt > 0:
-            a = draw({1:totalId, 2:totalDt})
+            a = draw({1:totalId, 2:totalDt}, rng)
             events[nextEventPhase].append((IncomingData if a == 1 else DataTransfer)(None))
             if a == 1:
                 totalId -= 1
@@ -760,28 +1121,158 @@ class MissionGenerator:
                 nextEventPhase = p1
             else: nextEventPhase = p2
             
-        self.distributeEvents(events)
+        self._retry(mission, self.distributeEvents, mission, events, rng)
 
-    def distributeEvents(self, events):
-        """Distribute the given other events (no alerts) in their phases."""
-        p1, p2, p3 = self.mission.phases
+    def distributeEvents(self, mission, events, rng):
+        """Distribute the given other events (no alerts) in their phases and add them to *mission*. The
+        start of each event is chosen randomly among the multiples of 5 within its phase at which it does
+        not collide with other events."""
+        p1, p2, p3 = mission.phases
         for phase in p1, p2, p3:
-            phaseLength = phase.length
+            # Start offsets are uniform integers in [0, maxOffset] rounded down to multiples of 5. Thus the
+            # last offset is less probable than the others unless maxOffset+1 is a multiple of 5.
+            maxOffset = phase.length - 11
             for event in events[phase]:
-                iterations = 0
-                while iterations < MAX_ITERATIONS:
-                    event.start = phase.start + round5(random.randint(0,phaseLength-11))
-                    if not self.mission.collides(event):
-                        self.mission.addEvent(event)
-                        break
-                    else: iterations += 1
-                else: raise InvalidMissionError("Cannot distribute special event {}".format(event))
+                starts = []
+                weights = []
+                for offset in range(0, maxOffset+1, 5):
+                    start = phase.start + offset
+                    if start >= 10 and not p2.start <= start < p2.start+5 \
+                            and mission.isFree(start, event.duration):
+                        starts.append(start)
+                        weights.append(min(5, maxOffset - offset + 1))
+                if len(starts) == 0:
+                    raise InvalidMissionError("Cannot distribute special event {}".format(type(event).__name__))
+                event.start = rng.choices(starts, weights)[0]
+                mission.addEvent(event)
+    
+
+class GenerationObserver:
+    """Observer of a MissionGenerator (see its *observer* argument). It is notified when one of the
+    stages in MissionGenerator.STAGES or makeMission itself starts and finishes. Stages are nested, e.g.
+    chooseThreatTuple starts and finishes while makeThreats is running.
+    
+    *attempt* counts the calls of a stage during the current makeMission call, starting at 1 (for
+    makeMission it counts all calls of the generator, so retries of failed missions have attempt > 1).
+    Times are values of time.perf_counter. This class does nothing; subclasses override the methods they
+    need.
+    """
+    def stageStarted(self, generator, stage, attempt, start):
+        pass
+    
+    def stageFinished(self, generator, stage, attempt, start, end, error):
+        """Called when a stage finishes. *error* is the exception that aborted the stage, or None."""
+        pass
+    
+
+class StageStatistics(GenerationObserver):
+    """Observer which sums up, for each stage, the number of calls, the total time in seconds, the
+    maximal number of attempts within one mission and the failures by error message. Failures are only
+    counted for the stage which raised the error, not for the stages it propagates through."""
+    def __init__(self):
+        self.calls = collections.Counter()
+        self.seconds = collections.Counter()
+        self.maxAttempts = collections.Counter()
+        self.failures = collections.defaultdict(collections.Counter) # stage -> message -> count
+        self.errors = collections.Counter() # (stage, error type name) -> count
+        self._lastError = None
+        
+    def stageFinished(self, generator, stage, attempt, start, end, error):
+        self.calls[stage] += 1
+        self.seconds[stage] += end - start
+        self.maxAttempts[stage] = max(self.maxAttempts[stage], attempt)
+        if error is not None and error is not self._lastError:
+            self._lastError = error
+            self.failures[stage]["{}: {}".format(type(error).__name__, error)] += 1
+            self.errors[stage, type(error).__name__] += 1
+    
+    def report(self):
+        """Return a text report with one line per stage and the most frequent failures."""
+        lines = ["{:>22} {:>8} {:>10} {:>12} {:>9}".format('Stage', 'Calls', 'Time', 'Time/call', 'Failures')]
+        for stage in ('makeMission',) + MissionGenerator.STAGES:
+            if self.calls[stage] > 0:
+                lines.append("{:>22} {:>8} {:>9.3f}s {:>10.1f}µs {:>9}".format(
+                        stage, self.calls[stage], self.seconds[stage],
+                        1e6 * self.seconds[stage] / self.calls[stage], sum(self.failures[stage].values())))
+        for stage in ('makeMission',) + MissionGenerator.STAGES:
+            for message, count in self.failures[stage].most_common(3):
+                lines.append("{}: {}x {}".format(stage, count, message))
+        return '\n'.join(lines)
+        
+
+def makeSeededMission(options, seed, observer=None):
+    """Generate a mission using *options* with a random number generator seeded by *seed*. If
+    generation fails with an InvalidMissionError, it is retried up to MAX_ITERATIONS times. Unlike
+    unseeded generation, this does not adapt the iteration limit, so that the result only depends on
+    *options* and *seed*. The global random number generator is not used, so this may be called from
+    several threads at once. *observer* is passed to the MissionGenerator.
+    """
+    generator = MissionGenerator(options, observer)
+    return generator.makeMission(random.Random(seed), MAX_ITERATIONS)
+        
+
+class IterationStatistics:
+    """Number of iterations which makeMission needed for one set of options. An iteration fails if all
+    retries of its stages fail (compare MissionGenerator.makeMission). The observed failure rate p is used
+    to choose the iteration limit L such that p**L is below TARGET_FAILURE_PROBABILITY. The limit only
+    grows above MAX_ITERATIONS for options which succeed reasonably often: Options which never succeed (or
+    almost never) would otherwise get the largest limit and waste the most work before failing anyway.
+    """
+    TARGET_FAILURE_PROBABILITY = 1e-9
+    MIN_ITERATIONS = 10         # bounds of the limit
+    MAX_LIMIT = 3 * MAX_ITERATIONS
+    MIN_SAMPLES = 100           # use MAX_ITERATIONS until this many iterations have been observed
+    MAX_FAILURE_RATE = 0.9      # use MAX_ITERATIONS if the failure rate is higher
+    
+    def __init__(self):
+        self.iterations = 0 # total number of iterations
+        self.failures = 0   # number of failed iterations
+        self._lock = threading.Lock()
+        
+    def record(self, iterations, success):
+        """Record a call of makeMission which needed *iterations* iterations and succeeded or failed."""
+        with self._lock:
+            self.iterations += iterations
+            self.failures += iterations - 1 if success else iterations
+        
+    def failureRate(self):
+        # Laplace's rule of succession, so that the rate is never exactly 0 or 1
+        return (self.failures + 1) / (self.iterations + 2)
     
+    def limit(self):
+        """Return the current iteration limit."""
+        failureRate = self.failureRate()
+        if self.iterations < self.MIN_SAMPLES or self.failures == self.iterations \
+                or failureRate > self.MAX_FAILURE_RATE:
+            return MAX_ITERATIONS
+        limit = math.ceil(math.log(self.TARGET_FAILURE_PROBABILITY) / math.log(failureRate))
+        return max(self.MIN_ITERATIONS, min(limit, self.MAX_LIMIT))
+    
+    
+_iterationStatistics = {}
 
-def binomial(min, max, p=None, m=None):
+def getIterationStatistics(options):
+    """Return the IterationStatistics for *options* (shared by all options with the same frozen form, see
+    Options.freeze)."""
+    key = options.freeze()
+    statistics = _iterationStatistics.get(key)
+    if statistics is None:
+        statistics = _iterationStatistics.setdefault(key, IterationStatistics())
+    return statistics
+    
+
+def missionSeeds(seed, number):
+    """Return an iterator over *number* seeds for single missions that are derived from *seed*. If
+    *seed* is None, the seeds are not reproducible."""
+    rng = random.Random(seed)
+    return (rng.getrandbits(64) for i in range(number))
+    
+
+def binomial(min, max, p=None, m=None, rng=random):
     """Return a sample from a binomial distribution between min and max (including both values). The
     higher *p* is the more probable are values near *max*. Alternatively you can specify the mean *m*.
-    In this case *p* will be calculated such that *m* is the distribution's mean.
+    In this case *p* will be calculated such that *m* is the distribution's mean. *rng* is the random
+    number generator (a random.Random), by default the global one.
     """
     if max < min:
          raise ValueError("Binomial: max must be greater or equal min. Max: {}, min: {}".format(max, min))
@@ -793,20 +1284,29 @@ def binomial(min, max, p=None, m=None):
         p = (m-min) / (max-min) # => m is the expectation
     result = min
     for i in range(max-min):
-        if random.random() < p:
+        if rng.random() < p:
             result += 1
     return result
     
 
-def draw(dist):
+def binomialDistribution(min, max, p):
+    """Return the distribution of binomial(min, max, p) as dict mapping each value to its probability."""
+    if max < min:
+         raise ValueError("Binomial: max must be greater or equal min. Max: {}, min: {}".format(max, min))
+    n = max - min
+    return {min+k: math.comb(n, k) * p**k * (1-p)**(n-k) for k in range(n+1)}
+    
+
+def draw(dist, rng=random):
     """Choose a sample according to *dist* (mapping values to their probability weights). E.g.
         draw({'a': 2, 'b': 1})
-       will return 'a' in two thirds of the cases.
+       will return 'a' in two thirds of the cases. *rng* is the random number generator (a
+       random.Random), by default the global one.
     """
     # See recipes on http://docs.python.org/3/library/random.html
     keys = list(dist.keys())
     cumDist = list(itertools.accumulate(dist[k] for k in keys))
-    x = random.random() * cumDist[-1]
+    x = rng.random() * cumDist[-1]
     return keys[bisect.bisect(cumDist,x)]
  
 
@@ -835,6 +1335,267 @@ def shiftTimes(times, distance, max=None):
         raise InvalidMissionError("Time {} reached max {}".format(times[-1], max))
     
 
+# Options which affect the distribution of turn assignments.
+TURN_ASSIGNMENT_OPTIONS = ('minTpPerPhase', 'maxTpPerPhase', 'earliestInternal', 'latestInternal',
+                           'earliestSeriousInternal', 'latestSeriousInternal',
+                           'allowConsecutiveInternalThreats', 'allowSimultaneousThreats',
+                           'maxInternalThreatsPerPhase', 'maxTpPerTurn')
+
+_turnAssignmentTables = {}
+
+def getTurnAssignmentTable(options, threatTuple):
+    """Return the TurnAssignmentTable for *options* and *threatTuple*. Tables are computed only once for
+    each combination of threat tuple and the relevant options."""
+    key = (options.key(TURN_ASSIGNMENT_OPTIONS), threatTuple.asTuple())
+    if key not in _turnAssignmentTables:
+        _turnAssignmentTables[key] = TurnAssignmentTable(options, threatTuple)
+    return _turnAssignmentTables[key]
+
+
+class TurnAssignmentTable:
+    """Exact distribution of the assignments of the threats in a threat tuple to turns.
+    
+    Threats are assigned as follows: Internal threats (serious ones first) and external threats each
+    run through a random permutation of the turns and greedily take the first turn that is allowed for
+    them. Afterwards the assignment is rejected if it violates the per-phase or per-turn constraints and
+    the process starts over. Instead of actually repeating this until an assignment is accepted, this
+    class enumerates all possible outcomes and computes their exact probabilities conditioned on
+    acceptance:
+    
+        - the internal threats only depend on the relative order of the turns they are allowed to take,
+          so all permutations of those turns are enumerated.
+        - external threats may take all turns. Thus, given the turns that are still available after
+          internal threats have been assigned, each choice of turns for normal and serious external
+          threats is equally likely.
+    
+    *probabilities* maps assignments (tuples of pairs (turn, threat type code), sorted by turn) to their
+    probabilities. *acceptanceProbability* is the probability that a single attempt of the greedy
+    algorithm yields a valid assignment.
+    """
+    # Order in which threats of the same turn appear in the result.
+    TYPE_ORDER = {'SIT': 0, 'IT': 1, 'T': 2, 'ST': 3}
+    
+    def __init__(self, options, threatTuple):
+        self.options = options
+        self.threatTuple = threatTuple.asTuple()
+        self.probabilities = {}
+        for internal, p in self._enumerateInternal(threatTuple).items():
+            if internal is None:
+                continue
+            for assignment, q in self._enumerateExternal(threatTuple, internal):
+                if self._isValid(assignment):
+                    key = tuple(sorted(assignment, key=lambda a: (a[0], self.TYPE_ORDER[a[1]])))
+                    self.probabilities[key] = self.probabilities.get(key, 0) + p*q
+        self.acceptanceProbability = sum(self.probabilities.values())
+        for key in self.probabilities:
+            self.probabilities[key] /= self.acceptanceProbability
+        self._keys = list(self.probabilities)
+        self._cumDist = list(itertools.accumulate(self.probabilities[k] for k in self._keys))
+        
+    def __repr__(self):
+        return "TurnAssignmentTable({})".format(self.probabilities)
+    
+    def sample(self, rng=random):
+        """Return a list of new alerts (with type and turn set) for a random assignment according to this
+        distribution, using the random number generator *rng*."""
+        if len(self._keys) == 0:
+            raise InvalidMissionError("Cannot assign threats {} to turns".format(self.threatTuple))
+        x = rng.random() * self._cumDist[-1]
+        assignment = self._keys[bisect.bisect(self._cumDist, x)]
+        return [Alert(turn=turn, type=getThreatType(code)) for turn, code in assignment]
+        
+    def _enumerateInternal(self, threatTuple):
+        """Return a dict mapping assignments of the internal threats to their probabilities. Assignments
+        are tuples of (turn, threat type code). None is used for attempts in which a threat cannot be
+        assigned."""
+        options = self.options
+        ranges = {T_SERIOUS_INTERNAL: range(options.earliestSeriousInternal, options.latestSeriousInternal+1),
+                  T_INTERNAL: range(options.earliestInternal, options.latestInternal+1)}
+        alerts = [tt for tt in (T_SERIOUS_INTERNAL, T_INTERNAL) for i in range(threatTuple[tt])]
+        turns = [turn for turn in range(1, 9) if any(turn in ranges[tt] for tt in alerts)]
+        counters = {}
+        total = 0
+        for permutation in itertools.permutations(turns):
+            internalTurns = list(permutation)
+            assignment = []
+            for tt in alerts:
+                for turn in internalTurns:
+                    if turn in ranges[tt]:
+                        break
+                else:
+                    assignment = None
+                    break
+                assignment.append((turn, tt.code))
+                internalTurns.remove(turn)
+                if not options.allowConsecutiveInternalThreats:
+                    if turn-1 in internalTurns:
+                        internalTurns.remove(turn-1)
+                    if turn+1 in internalTurns:
+                        internalTurns.remove(turn+1)
+            key = tuple(sorted(assignment)) if assignment is not None else None
+            counters[key] = counters.get(key, 0) + 1
+            total += 1
+        return {key: count / total for key, count in counters.items()}
+    
+    def _enumerateExternal(self, threatTuple, internal):
+        """Complete the assignment *internal* of internal threats by all possible assignments of external
+        threats. Yield pairs (assignment, probability)."""
+        if self.options.allowSimultaneousThreats:
+            available = list(range(1, 9))
+        else: available = [turn for turn in range(1, 9) if all(turn != t for t, code in internal)]
+        normal, serious = threatTuple[T_EXTERNAL], threatTuple[T_SERIOUS_EXTERNAL]
+        if normal + serious > len(available):
+            return
+        p = 1 / (math.comb(len(available), serious) * math.comb(len(available)-serious, normal))
+        for seriousTurns in itertools.combinations(available, serious):
+            remaining = [turn for turn in available if turn not in seriousTurns]
+            for normalTurns in itertools.combinations(remaining, normal):
+                yield (internal + tuple((turn, 'ST') for turn in seriousTurns)
+                                + tuple((turn, 'T') for turn in normalTurns)), p
+    
+    def _isValid(self, assignment):
+        """Return whether *assignment* satisfies the per-phase and per-turn constraints."""
+        options = self.options
+        for phaseTurns in (range(1, 5), range(5, 9)):
+            alerts = [code for turn, code in assignment if turn in phaseTurns]
+            if not options.minTpPerPhase <= sum(getThreatType(code).points for code in alerts) \
+                    <= options.maxTpPerPhase:
+                return False
+            if sum(1 for code in alerts if getThreatType(code).internal) > options.maxInternalThreatsPerPhase:
+                return False
+        if options.allowSimultaneousThreats:
+            points = {}
+            for turn, code in assignment:
+                points[turn] = points.get(turn, 0) + getThreatType(code).points
+            if any(p > options.maxTpPerTurn for p in points.values()):
+                return False
+        return True
+    
+
+# Options which affect the distribution of threat tuples.
+THREAT_TUPLE_OPTIONS = ('threatPoints', 'minCount', 'maxCount', 'minTpInternal', 'maxTpInternal',
+                        'minCountInternal', 'maxCountInternal', 'pInternal', 'pSerious', 'pSeriousInternal')
+
+_threatTupleTables = {}
+
+def getThreatTupleTable(options):
+    """Return the ThreatTupleTable for *options*. Tables are computed only once for each combination of
+    the relevant options."""
+    key = options.key(THREAT_TUPLE_OPTIONS)
+    if key not in _threatTupleTables:
+        _threatTupleTables[key] = ThreatTupleTable(options)
+    return _threatTupleTables[key]
+    
+    
+class ThreatTupleTable:
+    """Exact distribution of the threat tuples chosen by MissionGenerator.chooseThreatTuple for a set of
+    options. *probabilities* maps tuples (T, IT, ST, SIT) (compare ThreatTuple.asTuple) to their
+    probabilities. The table is computed by following all branches of the random choices made in
+    enumerateChoices. Branches in which the constraints cannot be satisfied are excluded (i.e. the table
+    is conditioned on success), their total probability is stored in *failureProbability*.
+    """
+    def __init__(self, options):
+        self.probabilities = {}
+        self.failureProbability = 0
+        self._threatTuples = {}
+        for tt, p in self.enumerateChoices(options):
+            if tt is None:
+                self.failureProbability += p
+            else:
+                key = tt.asTuple()
+                self.probabilities[key] = self.probabilities.get(key, 0) + p
+                self._threatTuples[key] = tt
+        if len(self.probabilities) == 0:
+            raise ValueError("chooseThreatTuple: There is no valid threat tuple for the given options.")
+        total = 1 - self.failureProbability
+        for key in self.probabilities:
+            self.probabilities[key] /= total
+        self._keys = list(self.probabilities)
+        self._cumDist = list(itertools.accumulate(self.probabilities[k] for k in self._keys))
+        
+    def __repr__(self):
+        return "ThreatTupleTable({})".format(self.probabilities)
+    
+    def threatTuple(self, key):
+        """Return the ThreatTuple for *key*, a key of *probabilities*. The returned object is shared and
+        must not be modified."""
+        return self._threatTuples[key]
+        
+    def sample(self, rng=random):
+        """Return a random ThreatTuple according to this distribution, using the random number generator
+        *rng*. The returned object is shared and must not be modified."""
+        x = rng.random() * self._cumDist[-1]
+        return self._threatTuples[self._keys[bisect.bisect(self._cumDist, x)]]
+    
+    @staticmethod
+    def enumerateChoices(options):
+        """Yield pairs (ThreatTuple, probability) for all combinations of random choices that are made
+        to choose a threat tuple. Instead of a ThreatTuple None is yielded for combinations that violate
+        the constraints."""
+        # Initialize with zero threats and check whether all parameters are valid
+        tt = ThreatTuple(options)
+        
+        # First split the threat points into external / internal
+        if not (tt.threatPoints % 2 == 0 and tt.threatPoints // 2 == tt.maxCount):
+            tpInternalDist = binomialDistribution(tt.minTpInternal, tt.maxTpInternal, options.pInternal)
+        else:
+            # In this special case we must only use serious threats. The line above could generate an odd
+            # number for tpInternal making it impossible to satisfy the maxCount constraint
+            # Thus we restrict the binomial distribution to even numbers.
+            tpInternalDist = {2*k: p for k, p in binomialDistribution(tt.minTpInternal//2,
+                                                                      tt.maxTpInternal//2,
+                                                                      options.pInternal).items()}
+        for tpInternal, p in tpInternalDist.items():
+            try:
+                tt1 = tt.copy()
+                tt1.tpInternal = tpInternal
+                tt1.tpExternal = tt1.threatPoints - tt1.tpInternal
+                
+                # First check whether the various 'internal' constraints enforce at least some normal or
+                # serious internal threats.
+                if tt1.tpInternal > tt1.maxCountInternal:
+                    tt1.add(T_SERIOUS_INTERNAL, tt1.tpInternal - tt1.maxCountInternal)
+                if tt1.tpInternal < 2 * tt1.minCountInternal:
+                    tt1.add(T_INTERNAL, 2 * tt1.minCountInternal - tt1.tpInternal)
+                    
+                # If tpExtern is odd, we must have a normal threat. Analogous for tpInternal.
+                if tt1.tpExternal % 2 == 1:
+                    tt1.add(T_EXTERNAL)
+                if tt1.tpInternal % 2 == 1:
+                    tt1.add(T_INTERNAL)
+                
+                # Now choose number of serious (external and internal) threats.
+                seriousDist = binomialDistribution(max(0, tt1.threatPoints-tt1.maxCount),
+                                                   min(tt1.threatPoints // 2, tt1.threatPoints-tt1.minCount),
+                                                   options.pSerious)
+            except ValueError:
+                yield None, p
+                continue
+            
+            for serious, q in seriousDist.items():
+                # Split serious threat into external / internal
+                try:
+                    seriousInternalDist = binomialDistribution(max(0, serious - tt1.tpExternal//2),
+                                                               min(tt1.tpInternal//2, serious),
+                                                               options.pSeriousInternal)
+                except ValueError:
+                    yield None, p*q
+                    continue
+                for seriousInternal, r in seriousInternalDist.items():
+                    try:
+                        tt2 = tt1.copy()
+                        tt2.add(T_SERIOUS_INTERNAL, seriousInternal)
+                        tt2.add(T_SERIOUS_EXTERNAL, serious - seriousInternal)
+                        
+                        # And add remaining threats as normal threats
+                        tt2.add(T_EXTERNAL, tt2.tpExternal)
+                        tt2.add(T_INTERNAL, tt2.tpInternal)
+                    except ValueError:
+                        yield None, p*q*r
+                    else:
+                        yield tt2, p*q*r
+    
+
 class ThreatTuple:
     """Data structure used by chooseThreatTuple. It contains counters for all four threat types and
     constraints based on *options*. Whenever threats are added via the add-method, it is checked whether
@@ -886,6 +1647,12 @@ class ThreatTuple:
     
     def __getitem__(self, threatType):
         return self.counters[threatType]
+    
+    def copy(self):
+        """Return a copy of this threat tuple including its counters and constraints."""
+        result = copy.copy(self)
+        result.counters = self.counters.copy()
+        return result
         
     def add(self, threatType, number=1):
         assert threatType in THREAT_TYPES
@@ -934,9 +1701,9 @@ class ThreatTuple:
 
     
 if __name__ == "__main__":
-    import argparse
+    import argparse, sys
     parser = argparse.ArgumentParser(description="Generate missions for Vlaada Chvatil's Space Alert.")
-    parser.add_argument('-n', "--number", help="Number of missions to generate for the statistics.", type=int, default=1000)
+    parser.add_argument('-n', "--number", help="Number of missions to generate for the statistics. If this or --alertCounters is given, print statistics instead of a single mission.", type=int, default=None)
     parser.add_argument("-p", "--players", help="Number of players. Only 4 or 5 players are supported.", type=int, choices=[4,5])
     parser.add_argument('--seed', help="Seed for the random number generator", type=int, default=None)
     parser.add_argument('-2', "--double", help="Generate a mission for double actions.", action="store_true")
@@ -944,10 +1711,10 @@ if __name__ == "__main__":
     parser.add_argument('--alertCounters', help="Print an overview over the number of alerts of different types.", action="store_true")
     parser.add_argument('-o', "--option", help="Set the value of an arbitrary option using the format key=value.", type=str, action="append")
     parser.add_argument('-d', '--difficulty', help="Set the difficulty.", type=str)
+    parser.add_argument('-w', '--workers', help="Number of worker processes for the statistics, defaults to the number of CPUs.", type=int, default=None)
+    parser.add_argument('--json', help="Print the statistics as JSON.", action="store_true")
 
     args = parser.parse_args()
-    if args.seed is not None:
-        random.seed(args.seed)
     
     if args.players is None:
         print("No player count specified. I will assume five players.")
@@ -959,10 +1726,23 @@ if __name__ == "__main__":
     if args.option is not None and len(args.option):
         overwrites = dict(keyEqValue.split('=') for keyEqValue in args.option)
         options.update(**overwrites)
+        import feasibility
+        analysis = feasibility.analyze(options)
+        if not analysis.feasible:
+            print(analysis.report())
+            sys.exit(1)
+    
+    if args.number is not None or args.alertCounters:
+        import missionstats
+        stats = missionstats.collectStatistics(options, args.number or 1000, args.workers, args.seed)
+        if args.json:
+            print(stats.toJSON())
+        else: print(stats.report(alertCounters=args.alertCounters))
+        sys.exit(0)
             
     generator = MissionGenerator(options)
     try:
-        mission = generator.makeMission()
+        mission = generator.makeMission(random.Random(args.seed))
     except RuntimeError as e:
         print("Error: {}".format(e))
     else: